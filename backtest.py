@@ -1,217 +1,230 @@
+import argparse
+import hashlib
+import json
+import logging
 import pymysql
-import pandas as pd
-import numpy as np
 import os
-import glob
 import re
-from datetime import timedelta
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from tools.credentials import get_login, get_pass
-from tools.tools import init_logging, get_prices, get_close
-
-# Initiate logging
-start = time.time()
-logger = init_logging(log_file='imb.log', append=False)
-logger.info('Backtest started')
+from tools.tools import init_logging, get_prices_bulk, get_closes
+from tools.engine import backtest_day
+from tools.sweep import expand_grid, sweep_day
+from tools.timers import timers
+from tools.cache import TickCache
+from tools.imbalances import load_imbalances, read_days
+from tools.replay import store as replay
+from tools.results import ResultsWriter
+from tools.volume import VolumeProvider
+from tools.watch import watch_files
+
+logger = logging.getLogger(__name__)
 
 cwd = os.getcwd()
-logger.info('Current directory: {}'.format(cwd))
 user = get_login()
 password = get_pass()
 
-# Connection to db
-con = pymysql.connect(host='10.12.1.25', port=3306, database='UsEquitiesL1', user=user, password=password)
-logger.info('Connected to db successfully')
-
 # Backtest config
-bt_config = {'hold': 60000, 'minVolume': 2000000, 'maxSpread': 0.2, 'absDeltaImbPct': 1}
+bt_config = {'hold': 60000, 'minVolume': 2000000, 'exchange': 'N', 'maxSpread': 0.2, 'absDeltaImbPct': 1}
 bp = 50000
 
-query_stock = "SELECT * " \
-              "FROM stock.Stock s " \
-              "WHERE `Timestamp` = %(date)s"
+# Parameter grid of sweep mode, every combination is evaluated from the same data
+sweep_grid = {'hold': [30000, 60000, 120000, 300000],
+              'minVolume': [2000000],
+              'maxSpread': [0.1, 0.2],
+              'absDeltaImbPct': [0.5, 1, 2]}
+
+# Exit rules evaluated with --exits, thresholds in percent of the open price, None disables a rule
+exit_grid = {'stopLoss': [None, 0.25, 0.5, 1],
+             'takeProfit': [None, 0.5, 1, 2],
+             'trailingStop': [None, 0.25, 0.5]}
+
+# Watch mode tries skipped and failed dates again after this many seconds
+retry_seconds = 300
+
+# Local cache of tick windows, None queries every window from tick.Equities. Size budget in GiB by default
+tick_cache_gb = 5
+
+# Connection to db, volume data and tick cache, one per process
+con = None
+volumes = None
+tick_cache = None
+
+
+def init_worker(timers_enabled=True, cache_gb=tick_cache_gb):
+    """Open the connection to db of the current process. cache_gb is the tick cache budget, None bypasses the cache."""
+    global con, volumes, tick_cache
+    timers.enabled = timers_enabled
+    tick_cache = TickCache(cwd + '/data/ticks', max_bytes=int(cache_gb * 1024 ** 3)) if cache_gb is not None else None
+    if not logging.getLogger().handlers:
+        # Workers started without fork don't inherit logging set up
+        init_logging(log_file='imb.log', append=True)
+    if replay.replaying:
+        # Everything is served from recorded queries
+        con = None
+    else:
+        con = pymysql.connect(host='10.12.1.25', port=3306, database='UsEquitiesL1', user=user, password=password)
+        logger.info('Connected to db successfully')
+    volumes = VolumeProvider(con, cwd + '/data/stock')
+
+
+def backtest_date(f, sweep=False, exits=False, df=None, load_stages=None):
+    """Backtest one day of imbalances, df is the day already read from f if given, load_stages the timing of that.
 
-path = cwd + '/data/imbalances/*.csv'
-data = []
-files = sorted(glob.glob(path))
-processed = []
-while files:
+    Returns the date, its trades (None if the day was skipped) and the stage timings of the day.
+    """
     start_f = time.time()
-    f = files[0]
-    if f in processed:
-        logger.info('File has already been processed')
-        continue
+    timers.reset()
+    date = get_date(f)
+    logger.info('Date: {}'.format(date))
+    if df is None:
+        with timers.stage('csv load'):
+            df = load_imbalances(f)
+    elif load_stages:
+        timers.merge(load_stages)
+    symbols = df['Symbol'].unique()
+    logger.info('Symbols in universe: {}'.format(len(symbols)))
+
+    with timers.stage('volume query'):
+        volume_df = volumes.get(date)
+    if volume_df.empty:
+        logger.info('Volume data is empty')
+        return date, None, timers.stages
+
+    get_prices = partial(tick_cache.fetch, get_prices=get_prices_bulk) if tick_cache is not None else get_prices_bulk
+    get_moc = partial(get_closes, cache_dir=cwd + '/data/moc')
+    exits = exit_grid if exits else None
+    if sweep:
+        data = sweep_day(df, volume_df, date, expand_grid(sweep_grid), bp, get_prices, get_moc, exits)
     else:
-        processed.append(f)
-        date = re.search('imbalances/(.*).csv', f).group(1)
-        logger.info('Date: {}'.format(date))
-        df = pd.read_csv(f, index_col=0)
-        symbols = df['Symbol'].unique()
-        logger.info('Symbols in universe: {}'.format(len(symbols)))
-
-        logger.info('Downloading volume data')
-        volume_df = pd.read_sql_query(query_stock, con, params={'date': date})
-        logger.info('Downloaded volume data')
-        if volume_df.empty:
-            logger.info('Volume data is empty')
-            continue
-
-        for s in symbols:
-            start_s = time.time()
-            logger.info('Symbol:{}'.format(s))
-            moc_close_price = np.nan
-            volume = volume_df.loc[volume_df['Symbol'] == s, 'Shares'].iloc[-1]
-
-            current_symbol = df[df['Symbol'] == s].copy()
-            current_symbol['reverse_count'] = np.arange(start=1, stop=len(current_symbol) + 1)
-            current_symbol['imbBeforeReversePct'] = current_symbol['PreviShares'] * 100 / volume
-            current_symbol['imbAfterReversePct'] = current_symbol['iShares'] * 100 / volume
-            current_symbol['deltaImbPct'] = current_symbol['imbAfterReversePct'] - current_symbol['imbBeforeReversePct']
-
-            current_symbol = current_symbol[current_symbol['deltaImbPct'].abs() > bt_config['absDeltaImbPct']]
-            if current_symbol.empty:
-                logger.info('Delta imbalance filter')
-                continue
-
-            current_symbol['direction'] = np.where(current_symbol['deltaImbPct'] > 0, 'Long', 'Short')
-            current_symbol['open_price'] = np.where(current_symbol['direction'] == 'Long',
-                                                    current_symbol['Ask_P'], current_symbol['Bid_P'])
-            current_symbol['spread_at_open'] = current_symbol['Ask_P'] - current_symbol['Bid_P']
-
-            current_symbol = current_symbol[current_symbol['spread_at_open'] < bt_config['maxSpread']]
-            if current_symbol[current_symbol['spread_at_open'] < bt_config['maxSpread']].empty:
-                logger.info('Spread filter')
-                continue
-
-            # Trade only first reversal
-            current_symbol = current_symbol[current_symbol['reverse_count'] == current_symbol['reverse_count'].min()]
-
-            # Set time index
-            current_symbol.loc[:, 'TIME'] = current_symbol.loc[:, 'TIME'].map(lambda x: x.lstrip('0 days '))
-            current_symbol['start'] = current_symbol.loc[:, ['Timestamp', 'TIME']].apply(lambda x: ' '.join(x), axis=1)
-            current_symbol.index = pd.to_datetime(current_symbol['start'])
-            # Add exit time and status
-            current_symbol['stop'] = current_symbol.index + timedelta(milliseconds=bt_config['hold'])
-            current_symbol.loc[current_symbol['stop'] > pd.to_datetime(date + ' ' + '16:00:00'), 'close_status'] = 'moc'
-            current_symbol['close_status'] = current_symbol['close_status'].fillna('market')
-            current_symbol.loc[
-                current_symbol['stop'] > pd.to_datetime(date + ' ' + '16:00:00'), 'stop'] = pd.to_datetime(
-                date + ' ' + '16:00:00')
-            # Filter if start is after market close
-            current_symbol = current_symbol.loc[current_symbol.index < pd.to_datetime(date + ' ' + '15:59:59')]
-
-            if current_symbol.empty:
-                logger.info('Time entry filter')
-                continue
-
-            # Slice price/market data needed for returns calculation
-            datetime_start = current_symbol['start'].iloc[0].split('.')[0]
-            datetime_stop = str(current_symbol['stop'].iloc[0]).split('.')[0]
-
-            logger.info('Time range from {} to {}'.format(datetime_start, datetime_stop))
-
-            # Slice prices
-            current_prices = get_prices(s, date, datetime_start, datetime_stop)
-            current_prices = current_prices[current_prices.index > current_symbol['start'].iloc[0]]
-
-            if current_prices.empty:
-                logger.info('No price data for this reversal')
-                continue
-
-            direction = current_symbol['direction'].iloc[0]
-            open_price = current_symbol['open_price'].iloc[0]
-            close_status = current_symbol['close_status'].iloc[0]
-            spread_at_open = current_symbol['spread_at_open'].iloc[0]
-            initial_imb = current_symbol['PreviShares'].iloc[0]
-            paired_imb = current_symbol['iPaired'].iloc[0]
-
-            if close_status == 'moc':
-                logger.info('Close status moc')
-                # Get moc price for the date
-                df_moc_close_price = get_close(s, date)
-
-                if df_moc_close_price.empty:
-                    logger.info('No moc data')
-                    continue
-
-                moc_close_price = df_moc_close_price['tPrice'].iloc[0]
-                logger.info('Moc price {} for symbol {}'.format(moc_close_price, s))
-                close_price = current_prices['Bid_P'].iloc[-1] if direction == 'Long' else current_prices['Ask_P'].iloc[-1] #moc_close_price
-                spread_at_close = 0
-                logger.info('Close position with moc order')
-            else:
-                logger.info('Close status market')
-                close_price = current_prices['Bid_P'].iloc[-1] if direction == 'Long' else current_prices['Ask_P'].iloc[-1]
-                spread_at_close = current_prices['Ask_P'].iloc[-1] - current_prices['Bid_P'].iloc[-1]
-
-            # What is high/low market price and respective time indexes where pnl is max/min considering direction
-            # Need this for MAE/MFE analysis to optimize entry and exit timing and potentially stop loss
-            max_pnl_time = pd.to_numeric(current_prices['Bid_P']).idxmax() if direction == 'Long' else pd.to_numeric(current_prices['Ask_P']).idxmin()
-            max_pnl_price = pd.to_numeric(current_prices['Bid_P']).max() if direction == 'Long' else pd.to_numeric(current_prices['Ask_P']).min()
-            min_pnl_time = pd.to_numeric(current_prices['Bid_P']).idxmin() if direction == 'Long' else pd.to_numeric(current_prices['Ask_P']).idxmax()
-            min_pnl_price = pd.to_numeric(current_prices['Bid_P']).min() if direction == 'Long' else pd.to_numeric(current_prices['Ask_P']).max()
-
-            # Pnl
-            if close_status == 'market':
-                delta_move = close_price - open_price if direction == 'Long' else open_price - close_price
+        data = backtest_day(df, volume_df, date, bt_config, bp, get_prices, get_moc, exits)
+
+    stop_f = time.time()
+    logger.info('File time: {}'.format(stop_f - start_f))
+
+    return date, data, timers.stages
+
+
+def get_date(f):
+    return re.search('imbalances/(.*).csv', f).group(1)
+
+
+def save_date(writer, date, trades, stages):
+    """Save trades of a date and log where the time of the date went. Returns False if the date was skipped."""
+    timers.reset()
+    timers.merge(stages)
+    if trades is not None:
+        with timers.stage('write'):
+            writer.write_day(date, trades)
+        logger.info('Positions saved: {}'.format(date))
+    if timers.stages:
+        logger.info('Stage times of {}:\n{}'.format(date, timers.summary().to_string(float_format='{:.6f}'.format)))
+
+    return trades is not None
+
+
+def get_writer(sweep=False, exits=False):
+    """Positions store of the current config or sweep grid, one file per date."""
+    if sweep:
+        grid_hash = hashlib.md5(json.dumps(sweep_grid, sort_keys=True).encode()).hexdigest()[:8]
+        name = 'sweep_{}'.format(grid_hash)
+    else:
+        name = 'hold_{}_volume_{}_spread_{}_deltaimb_{}'.format(bt_config['hold'], bt_config['minVolume'],
+                                                                bt_config['maxSpread'], bt_config['absDeltaImbPct'])
+    if exits:
+        name += '_exits_{}'.format(hashlib.md5(json.dumps(exit_grid, sort_keys=True).encode()).hexdigest()[:8])
+    return ResultsWriter(cwd + '/data/positions/' + name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest closing imbalance reversals')
+    parser.add_argument('--workers', type=int, default=1, help='number of dates backtested in parallel')
+    parser.add_argument('--sweep', action='store_true', help='evaluate every config of sweep_grid instead of bt_config')
+    parser.add_argument('--exits', action='store_true', help='evaluate every combination of exit_grid on each trade')
+    parser.add_argument('--no-timers', action='store_true', help='disable stage timers')
+    parser.add_argument('--tick-cache-gb', type=float, default=tick_cache_gb, help='size budget of the tick cache')
+    parser.add_argument('--no-tick-cache', action='store_true',
+                        help='query all tick windows from the database and leave the cache untouched')
+    parser.add_argument('--watch', action='store_true', help='keep running and backtest new imbalance files as they land')
+    args = parser.parse_args()
+
+    # Initiate logging
+    start = time.time()
+    init_logging(log_file='imb.log', append=False)
+    logger.info('Backtest started')
+    logger.info('Current directory: {}'.format(cwd))
+    # Recorded tick queries depend on the windows the cache misses, so recording and replaying bypass it
+    cache_gb = None if args.no_tick_cache or replay.mode is not None else args.tick_cache_gb
+    logger.info('Tick cache: {}'.format('off' if cache_gb is None else '{} GiB'.format(cache_gb)))
+
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                       initargs=(not args.no_timers, cache_gb))
+    else:
+        executor = None
+        init_worker(not args.no_timers, cache_gb)
+
+    writer = get_writer(args.sweep, args.exits)
+    # Dates in the positions manifest are done, restarts skip them
+    completed = writer.completed()
+    running = {}
+    # Skipped and failed dates as file: time of the next try in watch mode
+    retry = {}
+
+    def finish(f, result):
+        """Save the result of a date, a failed or skipped one is tried again later in watch mode."""
+        try:
+            done = save_date(writer, *result())
+        except Exception:
+            logger.exception('Date {} failed'.format(get_date(f)))
+            done = False
+        if done:
+            retry.pop(f, None)
+        else:
+            retry[f] = time.time() + retry_seconds if args.watch else None
+
+    try:
+        for files in watch_files(cwd + '/data/imbalances'):
+            pending = [f for f in files if get_date(f) not in completed]
+            if len(files) > len(pending):
+                logger.info('Files already processed: {}'.format(len(files) - len(pending)))
+            due = [f for f, t in retry.items() if t is not None and t <= time.time() and f not in running.values()]
+            if due:
+                logger.info('Trying again: {}'.format(', '.join(get_date(f) for f in due)))
+                pending = sorted(set(pending) | set(due))
+            if executor is None and len(pending) > 1:
+                # Volume data of the whole batch in one query
+                volumes.load(get_date(pending[0]), get_date(pending[-1]))
+
+            if executor is not None:
+                for f in pending:
+                    logger.info('New file: {}'.format(f))
+                    running[executor.submit(backtest_date, f, args.sweep, args.exits)] = f
             else:
-                delta_move = moc_close_price - open_price if direction == 'Long' else open_price - moc_close_price
-            position_size = current_symbol['Ask_S'].iloc[0] if direction == 'Long' else current_symbol['Bid_S'].iloc[0]
-
-            position_pnl = delta_move * position_size
-            delta_move_pct = delta_move * 100 / open_price
-
-            position_size_bp = min(bp / open_price, position_size)
-            position_pnl_bp = delta_move * position_size_bp
-
-            d = {'date': date,
-                 'symbol': s,
-                 'volume': volume,
-                 'start': datetime_start,
-                 'stop': datetime_stop,
-                 'initial_imb': initial_imb,
-                 'paired_imb': paired_imb,
-                 'direction': direction,
-                 'open_price': open_price,
-                 'spread_at_open': spread_at_open,
-                 'close_price': close_price,
-                 'moc_close_price': moc_close_price,
-                 'close_status': close_status,
-                 'spread_at_close': spread_at_close,
-                 'max_pnl_time': max_pnl_time,
-                 'max_pnl_price': max_pnl_price,
-                 'min_pnl_time': min_pnl_time,
-                 'min_pnl_price': min_pnl_price,
-                 'size': position_size_bp,
-                 'reverse_count': current_symbol['reverse_count'].iloc[0],
-                 'imbBeforeReversePct': current_symbol['imbBeforeReversePct'].iloc[0],
-                 'imbAfterReversePct': current_symbol['imbAfterReversePct'].iloc[0],
-                 'deltaImbPct': current_symbol['deltaImbPct'].iloc[0],
-                 'delta_move': delta_move,
-                 'delta_move_pct': delta_move_pct,
-                 'pnl': position_pnl_bp}
-
-            logger.info(d)
-            data.append(d)
-            stop_s = time.time()
-            logger.info('Stock time: {}'.format(stop_s - start_s))
-
-        stat = pd.DataFrame(data)
-        stat.to_csv(
-            cwd + '/data/positions/hold_{}_volume_{}_spread_{}_deltaimb_{}_date_{}.csv'.format(bt_config['hold'],
-                                                                                               bt_config['minVolume'],
-                                                                                               bt_config['maxSpread'],
-                                                                                               bt_config[
-                                                                                                   'absDeltaImbPct'],
-                                                                                               date))
-        stop_f = time.time()
-        logger.info('File time: {}'.format(stop_f - start_f))
-    files = sorted(glob.glob(path))
-    logger.info('Update files in case new files appeared. Files in directory: {}'.format(len(files)))
-    files = [x for x in files if x not in processed]
-    logger.info('Remove processed files. Left to process: {}'.format(len(files)))
-logger.info('Positions saved')
-logger.info('Backtest finished')
-stop = time.time()
-logger.info('Time: {}'.format(stop - start))
+                # Next days are read in background threads while the current one is backtested
+                for f, df, load_stages in read_days(pending):
+                    logger.info('New file: {}'.format(f))
+                    finish(f, lambda: backtest_date(f, args.sweep, args.exits, df, load_stages))
+
+            for future in [x for x in running if x.done()]:
+                finish(running.pop(future), future.result)
+
+            # Without watch mode stop once no new files appeared and all dates are done
+            if not args.watch and not files and not running:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if retry:
+        logger.info('Dates not backtested: {}'.format(', '.join(sorted(get_date(f) for f in retry))))
+    logger.info('Backtest finished')
+    stop = time.time()
+    logger.info('Time: {}'.format(stop - start))
+
+
+if __name__ == '__main__':
+    main()
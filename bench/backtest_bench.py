@@ -0,0 +1,146 @@
+"""Offline benchmark of the backtest pipeline on synthetic data.
+
+Imbalance CSVs, stock.Stock volumes and tick.Equities quotes are generated at the requested scale. Days are
+backtested by backtest.backtest_date and saved by backtest.save_date with only the database queries swapped for
+in-memory stand-ins, so no database is needed. Run from the repository root:
+
+    python -m bench.backtest_bench --symbols 2000 --days 5 --ticks-per-sec 2
+"""
+import argparse
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import backtest
+from bench.synthetic import make_symbols, make_imbalances, make_volume, SyntheticTicks
+from tools.cache import TickCache
+from tools.imbalances import read_days
+from tools.results import ResultsWriter
+from tools.timers import Timers, timers
+from tools.trading_calendar import trading_days
+from tools.volume import VolumeProvider
+
+logger = logging.getLogger(__name__)
+
+
+class SyntheticVolumes(VolumeProvider):
+    """VolumeProvider serving generated stock.Stock rows, saved to its local store under root."""
+
+    def __init__(self, frames, root=None):
+        super(SyntheticVolumes, self).__init__(None, root)
+        self.frames = frames
+
+    def fetch(self, start, stop):
+        return pd.concat([x for date, x in self.frames.items() if start <= date <= stop])
+
+
+def generate(root, dates, symbols, ticks_per_sec, seed):
+    """Write imbalance CSVs of dates to root. Returns the volume frames by date and the tick stand-in."""
+    rng = np.random.default_rng(seed)
+    prices = rng.uniform(5, 300, len(symbols))
+    os.makedirs(os.path.join(root, 'imbalances'), exist_ok=True)
+    frames = {}
+    for date in dates:
+        make_imbalances(date, symbols, prices, rng).to_csv(os.path.join(root, 'imbalances', date + '.csv'))
+        frames[date] = make_volume(date, symbols, rng)
+
+    return frames, SyntheticTicks(symbols, prices, ticks_per_sec, seed)
+
+
+def run(root, dates, volumes, ticks, sweep=False, exits=False, trace=False):
+    """Backtest dates like a serial backtest.py run. Returns the stage timings, rows per stage and day stats.
+
+    Days are read ahead by read_days, ticks go through a TickCache under root and volumes through their local store.
+    """
+    total = Timers()
+    rows = {}
+    days = []
+    writer = ResultsWriter(os.path.join(root, 'positions'))
+
+    def get_prices_bulk(date, windows):
+        prices = ticks.get_prices(date, windows)
+        rows['tick fetch'] = rows.get('tick fetch', 0) + len(prices)
+        return prices
+
+    backtest.get_prices_bulk = get_prices_bulk
+    backtest.get_closes = lambda date, cache_dir=None: ticks.get_closes(date)
+    backtest.tick_cache = TickCache(os.path.join(root, 'ticks'))
+    backtest.volumes = volumes
+    timers.enabled = True
+
+    files = [os.path.join(root, 'imbalances', date + '.csv') for date in dates]
+    volumes.load(dates[0], dates[-1])
+    for f, df, load_stages in read_days(files):
+        # Ticks are generated outside of the measured stages
+        ticks.prepare(backtest.get_date(f))
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+
+        date, data, stages = backtest.backtest_date(f, sweep, exits, df, load_stages)
+        backtest.save_date(writer, date, data, stages)
+
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        # save_date leaves the stages of the day including the write
+        total.merge(timers.stages)
+
+        trades = len(data) if data is not None else 0
+        for stage, n in [('csv load', len(df)), ('volume query', len(volumes.get(date))), ('filter', len(df)),
+                         ('pnl compute', trades), ('write', trades)]:
+            rows[stage] = rows.get(stage, 0) + n
+        days.append({'date': date, 'imbalances': len(df), 'trades': trades, 'seconds': seconds, 'peak_bytes': peak})
+
+    return total, rows, pd.DataFrame(days).set_index('date')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backtest pipeline on synthetic data')
+    parser.add_argument('--symbols', type=int, default=2000, help='symbols per day')
+    parser.add_argument('--days', type=int, default=5, help='number of trading days')
+    parser.add_argument('--ticks-per-sec', type=float, default=2, help='quote updates per second per symbol')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sweep', action='store_true', help='run sweep mode over backtest.sweep_grid')
+    parser.add_argument('--exits', action='store_true', help='evaluate backtest.exit_grid on every trade')
+    parser.add_argument('--trace', action='store_true', help='measure peak Python memory per day with tracemalloc')
+    parser.add_argument('--keep', help='generate into this directory and keep it instead of a temporary one')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(logging.INFO)
+
+    root = args.keep or tempfile.mkdtemp(prefix='backtest_bench_')
+    dates = list(trading_days('2020-02-03', '2021-12-31')[:args.days])
+    symbols = make_symbols(args.symbols)
+    try:
+        start = time.perf_counter()
+        frames, ticks = generate(root, dates, symbols, args.ticks_per_sec, args.seed)
+        logger.info('Generated {} days of {} symbols in {:.2f}s'.format(len(dates), len(symbols),
+                                                                        time.perf_counter() - start))
+
+        total, rows, days = run(root, dates, SyntheticVolumes(frames, os.path.join(root, 'stock')), ticks, args.sweep, args.exits, args.trace)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    summary = total.summary()
+    summary['rows'] = pd.Series(rows).astype('Int64')
+    summary['rows/s'] = summary['rows'] / summary['total']
+    logger.info('Days:\n{}'.format(days.to_string(float_format='{:.3f}'.format)))
+    logger.info('Stages:\n{}'.format(summary.to_string(float_format='{:.6f}'.format)))
+    logger.info('Total {:.3f}s, {:.1f} days/s, max RSS {:.0f} MB'.format(
+        days['seconds'].sum(), len(days) / days['seconds'].sum(),
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""Local stand-in for a ClickHouse server speaking the native TCP protocol.
+
+Serves pre-encoded blocks of generated data to clickhouse_driver, so the receive path of the driver (receive_packet,
+block streams, column decoders) can be measured without a network or a real server. Any SELECT returns the same
+data set; 'USE' and 'SHOW TABLES' are answered so pandasConnector works on top of it.
+"""
+import logging
+import socketserver
+import threading
+from datetime import date, datetime
+from io import BytesIO
+import numpy as np
+
+from clickhouse_driver import defines
+from clickhouse_driver.block import BlockInfo
+from clickhouse_driver.columns.service import write_column
+from clickhouse_driver.protocol import ClientPacketTypes, ServerPacketTypes
+from clickhouse_driver.reader import read_binary_str, read_binary_uint8, read_varint
+from clickhouse_driver.settings.available import settings as available_settings, limits as available_limits
+from clickhouse_driver.settings.types import SettingString, SettingFloat
+from clickhouse_driver.writer import write_binary_str, write_binary_uint8, write_varint
+
+logger = logging.getLogger(__name__)
+
+# Columns of get_prices_bulk results
+tick_columns = [('WindowId', 'UInt32'), ('Time', 'UInt32'), ('TimeMicro', 'UInt32'), ('MsgCnt', 'UInt64'),
+                ('Bid_P', 'Float64'), ('Ask_P', 'Float64')]
+
+int_ranges = {'Int8': 2 ** 7, 'Int16': 2 ** 15, 'Int32': 2 ** 31, 'Int64': 2 ** 63}
+
+
+def parse_columns(spec):
+    """'Time UInt32,Bid_P Float64' -> [('Time', 'UInt32'), ('Bid_P', 'Float64')]"""
+    return [tuple(x.split()) for x in spec.split(',')]
+
+
+def generate_column(ch_type, n, rng):
+    """n random values of a ClickHouse type as the Python objects write_column takes."""
+    if ch_type.startswith('UInt'):
+        bits = int(ch_type[4:])
+        return rng.integers(0, 2 ** min(bits, 63), n, dtype=np.int64).tolist()
+    if ch_type in int_ranges:
+        bound = int_ranges[ch_type]
+        return rng.integers(-bound, bound - 1, n, dtype=np.int64).tolist()
+    if ch_type in ('Float32', 'Float64'):
+        return np.round(rng.uniform(1, 500, n), 2).tolist()
+    if ch_type == 'String':
+        return ['S{:05d}'.format(x) for x in rng.integers(0, 10000, n)]
+    if ch_type == 'Date':
+        return [date.fromordinal(x) for x in rng.integers(737000, 738000, n)]
+    if ch_type == 'DateTime':
+        return [datetime.utcfromtimestamp(x) for x in rng.integers(1500000000, 1600000000, n)]
+    raise ValueError('Unsupported column type: {}'.format(ch_type))
+
+
+def encode_block(columns, data, revision):
+    """Native encoding of a block given column-wise, data is None for a header block without rows."""
+    buf = BytesIO()
+    if revision >= defines.DBMS_MIN_REVISION_WITH_BLOCK_INFO:
+        BlockInfo().write(buf)
+    write_varint(len(columns), buf)
+    write_varint(len(data[0]) if data else 0, buf)
+    for i, (name, ch_type) in enumerate(columns):
+        write_binary_str(name, buf)
+        write_binary_str(ch_type, buf)
+        if data:
+            write_column(name, ch_type, data[i], buf)
+
+    return buf.getvalue()
+
+
+def compress_block(block, revision, method='lz4'):
+    """Block as sent on a connection with compression, needs lz4 and clickhouse-cityhash."""
+    from clickhouse_driver.compression import get_compressor_cls
+    from clickhouse_driver.streams.compressed import CompressedBlockOutputStream
+
+    out = BytesIO()
+    stream = CompressedBlockOutputStream(get_compressor_cls(method), defines.DEFAULT_COMPRESS_BLOCK_SIZE, out,
+                                         revision)
+    stream.fout.write(block)
+    stream.finalize()
+
+    return out.getvalue()
+
+
+def data_packet(block, revision):
+    buf = BytesIO()
+    write_varint(ServerPacketTypes.DATA, buf)
+    if revision >= defines.DBMS_MIN_REVISION_WITH_TEMPORARY_TABLES:
+        write_binary_str('', buf)
+    buf.write(block)
+
+    return buf.getvalue()
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """Native protocol server streaming rows of columns in blocks of block_rows, pre-encoded at start.
+
+    Use server.start() to serve from a background thread, the port is in server.port.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    revision = defines.CLIENT_VERSION
+
+    def __init__(self, columns=None, rows=1000000, block_rows=65536, host='127.0.0.1', port=0,
+                 tables=('Equities',), timezone='America/New_York', seed=0):
+        self.columns = columns or tick_columns
+        self.rows = rows
+        self.tables = list(tables)
+        self.timezone = timezone
+
+        rng = np.random.default_rng(seed)
+        self.blocks = []
+        for start in range(0, rows, block_rows):
+            n = min(block_rows, rows - start)
+            self.blocks.append(encode_block(self.columns, [generate_column(t, n, rng) for _, t in self.columns],
+                                            self.revision))
+        self.header = encode_block(self.columns, None, self.revision)
+        self.bytes = sum(len(x) for x in self.blocks)
+        # Data packets of a whole result by compression flag, built on first use
+        self.responses = {}
+        self.lock = threading.Lock()
+
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), Handler)
+        self.port = self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def encode(self, block, compression):
+        return data_packet(compress_block(block, self.revision) if compression else block, self.revision)
+
+    def response(self, compression):
+        """Header and data packets of the data set."""
+        with self.lock:
+            if compression not in self.responses:
+                self.responses[compression] = [self.encode(self.header, compression)] + \
+                                              [self.encode(x, compression) for x in self.blocks]
+        return self.responses[compression]
+
+    def tables_response(self, compression):
+        columns = [('name', 'String')]
+        return [self.encode(encode_block(columns, None, self.revision), compression),
+                self.encode(encode_block(columns, [self.tables], self.revision), compression)]
+
+
+class Handler(socketserver.StreamRequestHandler):
+    wbufsize = 1 << 16
+
+    def handle(self):
+        revision = self.receive_hello()
+        while True:
+            try:
+                packet_type = read_varint(self.rfile)
+            except EOFError:
+                return
+
+            if packet_type == ClientPacketTypes.PING:
+                write_varint(ServerPacketTypes.PONG, self.wfile)
+                self.wfile.flush()
+            elif packet_type == ClientPacketTypes.QUERY:
+                query, compression = self.receive_query(revision)
+                self.receive_external_tables(revision, compression)
+                self.respond(query, compression, revision)
+            elif packet_type == ClientPacketTypes.CANCEL:
+                continue
+            else:
+                logger.warning('Unsupported packet {}'.format(ClientPacketTypes.to_str(packet_type)))
+                return
+
+    def receive_hello(self):
+        if read_varint(self.rfile) != ClientPacketTypes.HELLO:
+            raise EOFError('Expected Hello')
+        read_binary_str(self.rfile)  # client name
+        read_varint(self.rfile)
+        read_varint(self.rfile)
+        client_revision = read_varint(self.rfile)
+        for _ in range(3):  # database, user, password
+            read_binary_str(self.rfile)
+
+        write_varint(ServerPacketTypes.HELLO, self.wfile)
+        write_binary_str('ClickHouse stand-in', self.wfile)
+        write_varint(defines.DBMS_VERSION_MAJOR, self.wfile)
+        write_varint(defines.DBMS_VERSION_MINOR, self.wfile)
+        write_varint(self.server.revision, self.wfile)
+        revision = min(client_revision, self.server.revision)
+        if revision >= defines.DBMS_MIN_REVISION_WITH_SERVER_TIMEZONE:
+            write_binary_str(self.server.timezone, self.wfile)
+        self.wfile.flush()
+
+        return revision
+
+    def receive_query(self, revision):
+        rfile = self.rfile
+        read_binary_str(rfile)  # query id
+        if revision >= defines.DBMS_MIN_REVISION_WITH_CLIENT_INFO and read_binary_uint8(rfile):
+            for _ in range(3):  # initial user, query id and address
+                read_binary_str(rfile)
+            read_binary_uint8(rfile)  # interface
+            for _ in range(3):  # os user, hostname, client name
+                read_binary_str(rfile)
+            for _ in range(3):  # client version and revision
+                read_varint(rfile)
+            if revision >= defines.DBMS_MIN_REVISION_WITH_QUOTA_KEY_IN_CLIENT_INFO:
+                read_binary_str(rfile)
+
+        # Settings up to an empty name, values are strings or varints depending on the setting
+        while True:
+            name = read_binary_str(rfile)
+            if not name:
+                break
+            setting = available_settings.get(name) or available_limits.get(name)
+            if issubclass(setting, (SettingString, SettingFloat)):
+                read_binary_str(rfile)
+            else:
+                read_varint(rfile)
+
+        read_varint(rfile)  # stage
+        compression = read_varint(rfile)
+        query = read_binary_str(rfile)
+
+        return query, compression
+
+    def receive_external_tables(self, revision, compression):
+        """Read Data packets of external tables up to the empty block ending them."""
+        if compression:
+            from clickhouse_driver.streams.compressed import CompressedBlockInputStream
+            block_in = CompressedBlockInputStream(self.rfile, revision)
+        else:
+            from clickhouse_driver.streams.native import BlockInputStream
+            block_in = BlockInputStream(self.rfile, revision)
+
+        while True:
+            if read_varint(self.rfile) != ClientPacketTypes.DATA:
+                raise EOFError('Expected Data')
+            if revision >= defines.DBMS_MIN_REVISION_WITH_TEMPORARY_TABLES:
+                read_binary_str(self.rfile)
+            if not block_in.read().columns_with_types:
+                return
+
+    def respond(self, query, compression, revision):
+        server = self.server
+        statement = query.strip().lower()
+        if statement.startswith('use '):
+            packets, rows, blocks, size = [], 0, 0, 0
+        elif statement.startswith('show tables'):
+            packets = server.tables_response(compression)
+            rows, blocks, size = len(server.tables), 1, sum(len(x) for x in packets)
+        else:
+            packets = server.response(compression)
+            rows, blocks, size = server.rows, len(server.blocks), server.bytes
+
+        wfile = self.wfile
+        for packet in packets:
+            wfile.write(packet)
+
+        write_varint(ServerPacketTypes.PROGRESS, wfile)
+        write_varint(rows, wfile)
+        write_varint(size, wfile)
+        if revision >= defines.DBMS_MIN_REVISION_WITH_TOTAL_ROWS_IN_PROGRESS:
+            write_varint(rows, wfile)
+
+        write_varint(ServerPacketTypes.PROFILE_INFO, wfile)
+        write_varint(rows, wfile)
+        write_varint(blocks, wfile)
+        write_varint(size, wfile)
+        write_binary_uint8(0, wfile)  # applied limit
+        write_varint(0, wfile)  # rows before limit
+        write_binary_uint8(0, wfile)  # calculated rows before limit
+
+        write_varint(ServerPacketTypes.END_OF_STREAM, wfile)
+        wfile.flush()
@@ -0,0 +1,76 @@
+"""Benchmark of the clickhouse_driver receive path against the local stand-in server.
+
+Measures decoding of pre-encoded blocks without a socket, Client.execute over a loopback connection and
+pandasConnector.read_sql_query on top of it. Run from the repository root:
+
+    python -m bench.driver_bench --rows 2000000 --block-rows 65536
+"""
+import argparse
+import logging
+import time
+from io import BytesIO
+import pandas as pd
+
+from bench.chserver import StandInServer, parse_columns
+from clickhouse_driver import Client
+from clickhouse_driver.pandasConnector import pandasConnector
+from clickhouse_driver.streams.native import BlockInputStream
+
+logger = logging.getLogger(__name__)
+
+
+def best_of(repeat, f):
+    """Smallest run time of f in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def decode_blocks(server):
+    for block in server.blocks:
+        BlockInputStream(BytesIO(block), server.revision).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clickhouse_driver against a local stand-in server')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--block-rows', type=int, default=65536)
+    parser.add_argument('--columns', help="column spec like 'Time UInt32,Bid_P Float64', ticks of get_prices_bulk "
+                                          "by default")
+    parser.add_argument('--compression', action='store_true', help='use LZ4 compression, needs lz4 and '
+                                                                   'clickhouse-cityhash')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    logger.setLevel(logging.INFO)
+
+    start = time.perf_counter()
+    server = StandInServer(parse_columns(args.columns) if args.columns else None, args.rows, args.block_rows)
+    server.start()
+    logger.info('Encoded {} rows in {} blocks, {:.1f} MB in {:.2f}s'.format(
+        server.rows, len(server.blocks), server.bytes / 1e6, time.perf_counter() - start))
+
+    try:
+        client = Client(host='127.0.0.1', port=server.port, database='tick', compression=args.compression)
+        connector = pandasConnector(host='127.0.0.1', db='tick', client=client)
+        query = 'SELECT * FROM tick.Equities'
+
+        results = [('decode blocks', best_of(args.repeat, lambda: decode_blocks(server))),
+                   ('Client.execute', best_of(args.repeat, lambda: client.execute(query, columnar=True))),
+                   ('read_sql_query', best_of(args.repeat, lambda: connector.read_sql_query(query, 'Equities')))]
+        client.disconnect()
+    finally:
+        server.stop()
+
+    report = pd.DataFrame(results, columns=['stage', 'seconds']).set_index('stage')
+    report['rows/s'] = server.rows / report['seconds']
+    report['MB/s'] = server.bytes / 1e6 / report['seconds']
+    logger.info('Best of {}:\n{}'.format(args.repeat, report.to_string(float_format='{:.3f}'.format)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+# Imbalance messages are published from 15:50, ticks are generated up to a few seconds after the close
+session_start = pd.Timedelta('15:50:00')
+session_stop = pd.Timedelta('16:00:05')
+
+
+def make_symbols(n):
+    return ['S{:05d}'.format(i) for i in range(n)]
+
+
+def make_imbalances(date, symbols, prices, rng, max_reversals=4):
+    """A day of imbalance reversals in the schema of data/imbalances, 1 to max_reversals per symbol."""
+    counts = rng.integers(1, max_reversals + 1, len(symbols))
+    symbol = np.repeat(symbols, counts)
+    n = len(symbol)
+
+    # Sorted times within every symbol
+    micros = rng.integers(0, 600 * 1000000, n)
+    micros = micros[np.lexsort((micros, np.repeat(np.arange(len(symbols)), counts)))]
+    mid = np.repeat(prices, counts) * (1 + rng.normal(0, 0.001, n))
+    spread = rng.choice([0.01, 0.02, 0.05, 0.1, 0.3], n)
+
+    # Sign of the imbalance flips on every reversal
+    previous = rng.integers(1000, 200000, n) * np.where(rng.random(n) < 0.5, -1, 1)
+    shares = -np.sign(previous) * rng.integers(1000, 200000, n)
+
+    return pd.DataFrame({'Symbol': symbol,
+                         'Timestamp': date,
+                         'TIME': (session_start + pd.to_timedelta(micros, unit='us')).astype(str),
+                         'iPaired': rng.integers(0, 500000, n),
+                         'Ask_P': np.round(mid + spread / 2, 2),
+                         'Bid_P': np.round(mid - spread / 2, 2),
+                         'Ask_S': rng.integers(100, 5000, n),
+                         'Bid_S': rng.integers(100, 5000, n),
+                         'iShares': shares,
+                         'PreviShares': previous})
+
+
+def make_volume(date, symbols, rng):
+    """Rows of stock.Stock as fetched by tools.volume.VolumeProvider."""
+    n = len(symbols)
+    return pd.DataFrame({'Timestamp': date,
+                         'Symbol': symbols,
+                         'Shares': rng.integers(100000, 20000000, n),
+                         'DailyShares': rng.integers(100000, 20000000, n),
+                         'Exchange': rng.choice(['N', 'Q'], n, p=[0.8, 0.2])})
+
+
+class SyntheticTicks(object):
+    """Stand-in for tick.Equities: quote streams of all symbols of a day held in memory.
+
+    get_prices and get_closes have the signatures and output of tools.tools.get_prices_bulk and get_closes.
+    Ticks arrive as a Poisson process with ticks_per_sec per symbol, quotes follow a random walk.
+    """
+
+    def __init__(self, symbols, prices, ticks_per_sec, seed=0):
+        self.symbols = list(symbols)
+        self.codes = {s: i for i, s in enumerate(self.symbols)}
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.ticks_per_sec = ticks_per_sec
+        self.seed = seed
+        self.date = None
+
+    def prepare(self, date):
+        """Generate the ticks of a date."""
+        rng = np.random.default_rng([self.seed, int(date.replace('-', ''))])
+        span = (session_stop - session_start).total_seconds()
+        counts = np.maximum(rng.poisson(self.ticks_per_sec * span, len(self.symbols)), 1)
+        n = counts.sum()
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        code = np.repeat(np.arange(len(self.symbols)), counts)
+
+        day = pd.Timestamp(date + ' 00:00:00').value + session_start.value
+        time = day + (rng.uniform(0, span, n) * 1e9).astype(np.int64)
+        self.time = time[np.lexsort((time, code))]
+        self.msg_cnt = np.arange(n, dtype=np.int64)
+
+        # Random walk of the mid starting at the price of the symbol
+        steps = rng.normal(0, 0.0002, n)
+        steps[self.offsets[:-1]] = 0
+        walk = np.cumsum(steps)
+        walk -= np.repeat(walk[self.offsets[:-1]], counts)
+        mid = np.repeat(self.prices, counts) * (1 + walk)
+        half_spread = rng.choice([0.005, 0.01, 0.025], n)
+        self.bid = np.round(mid - half_spread, 2)
+        self.ask = np.round(mid + half_spread, 2)
+        self.date = date
+
+    def get_prices(self, date, windows):
+        if date != self.date:
+            self.prepare(date)
+
+        parts = []
+        for i, (s, start, stop) in enumerate(zip(windows['Symbol'], windows['start'], windows['stop'])):
+            code = self.codes.get(s)
+            if code is None:
+                continue
+            lo, hi = self.offsets[code], self.offsets[code + 1]
+            # Second precision bounds like toDateTime(XTime)
+            a = lo + np.searchsorted(self.time[lo:hi], pd.Timestamp(start).value)
+            b = lo + np.searchsorted(self.time[lo:hi], pd.Timestamp(stop).value)
+            if b > a:
+                parts.append((i, s, a, b))
+
+        if not parts:
+            return pd.DataFrame()
+
+        positions = np.concatenate([np.arange(a, b) for _, _, a, b in parts])
+        lengths = [b - a for _, _, a, b in parts]
+        return pd.DataFrame({'WindowId': np.repeat([p[0] for p in parts], lengths),
+                             'Symbol': np.repeat([p[1] for p in parts], lengths),
+                             'MsgCnt': self.msg_cnt[positions],
+                             'Bid_P': self.bid[positions],
+                             'Ask_P': self.ask[positions]},
+                            index=pd.DatetimeIndex(self.time[positions]))
+
+    def get_closes(self, date):
+        if date != self.date:
+            self.prepare(date)
+        last = self.offsets[1:] - 1
+        return dict(zip(self.symbols, np.round((self.bid[last] + self.ask[last]) / 2, 2)))
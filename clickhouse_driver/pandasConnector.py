@@ -2,12 +2,22 @@
 from clickhouse_driver import Client
 import pandas as pd
 
+# Tables of a database by (host, port, db). They don't change during a run.
+tablesCache = {}
+
 class pandasConnector(object):
-    def __init__(self, host, user='default', password='', db=''):
+    def __init__(self, host, user='default', password='', db='', client=None):
         self.db= db
-        self.conn = Client(host=host, user=user, password=password, database=db)
-        self.useDB()
-        self.checkTables()
+        self.conn = client or Client(host=host, user=user, password=password, database=db)
+        key = (self.conn.connection.host, self.conn.connection.port, db)
+        if key in tablesCache:
+            self.dbCorrect= True
+            self.tables= tablesCache[key]
+        else:
+            self.useDB()
+            self.checkTables()
+            if self.dbCorrect:
+                tablesCache[key]= self.tables
 
     def useDB(self):
         self.dbCorrect= True
@@ -23,23 +33,29 @@ class pandasConnector(object):
              if len(self.tables)>0:
                  self.tables= list(self.tables[0])
 
-    def read_sql_query(self, query, tableName) -> object:
+    def read_sql_query(self, query, tableName, external_tables=None) -> object:
         dataDataFrame= pd.DataFrame()
         if self.dbCorrect:
             if len(self.tables)>0:
                 if tableName in self.tables:
-                    dataList = self.conn.execute(query, columnar=True,  with_column_types=True)
+                    dataList = self.conn.execute(query, columnar=True,  with_column_types=True,
+                                                 external_tables=external_tables)
                     if len(dataList)>0:
                         dataAll= dataList[0]
                         if len(dataAll)>0:
                             columns = [x[0] for x in dataList[1]]
                             #columns = self.conn.execute("DESC TABLE "+self.db+"."+tableName , columnar=True)
-                            dataDataFrame= pd.DataFrame(dataAll).T
+                            # Build from columns directly, keeps numeric dtypes instead of a transposed object frame
+                            dataDataFrame= pd.DataFrame(dict(enumerate(dataAll)))
                             #columns = columns[0]
                             dataDataFrame.columns = columns
                 else:
                     print("Wrong table name!")
         return (dataDataFrame)
 
+    def server_timezone(self):
+        serverInfo= self.conn.connection.server_info
+        return serverInfo.timezone if serverInfo is not None else None
+
 
 
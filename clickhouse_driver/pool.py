@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+import logging
+import os
+import threading
+from time import time
+
+from .client import Client
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool(object):
+    """
+    Process-wide pool of connected clients.
+
+    Clients idle for more than max_idle seconds are disconnected. Clients
+    keep the driver's ping before every query, so a socket dropped by the
+    server or network while idle is reconnected instead of failing the query.
+    Pool is reset after fork: sockets can't be shared between processes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.max_size = kwargs.pop('max_size', 4)
+        self.max_idle = kwargs.pop('max_idle', 300)
+        self.args = args
+        self.kwargs = kwargs
+
+        self.cond = threading.Condition()
+        self.pid = os.getpid()
+        self.idle = []
+        self.in_use = 0
+
+    def check_pid(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = []
+            self.in_use = 0
+
+    def get(self):
+        with self.cond:
+            self.check_pid()
+            self.reap()
+
+            while self.in_use >= self.max_size:
+                self.cond.wait()
+
+            self.in_use += 1
+
+        # Health checks are done outside of lock.
+        while True:
+            with self.cond:
+                if not self.idle:
+                    break
+
+                # Most recently used clients are the last ones.
+                client, _ = self.idle.pop()
+
+            if client.connection.connected:
+                return client
+
+            client.disconnect()
+
+        return Client(*self.args, **self.kwargs)
+
+    def put(self, client):
+        with self.cond:
+            if self.pid != os.getpid():
+                return
+
+            self.in_use -= 1
+            if client.connection.connected:
+                self.idle.append((client, time()))
+
+            self.cond.notify()
+
+    def reap(self):
+        deadline = time() - self.max_idle
+
+        alive = []
+        for client, last_used in self.idle:
+            if last_used < deadline:
+                logger.debug('Closing idle connection to %s',
+                             client.connection.get_description())
+                client.disconnect()
+            else:
+                alive.append((client, last_used))
+
+        self.idle = alive
+
+    def disconnect(self):
+        with self.cond:
+            for client, _ in self.idle:
+                client.disconnect()
+
+            self.idle = []
+
+    @contextmanager
+    def client(self):
+        client = self.get()
+        try:
+            yield client
+
+        finally:
+            self.put(client)
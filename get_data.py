@@ -1,55 +1,232 @@
+import argparse
+import hashlib
 import pymysql
 import pandas as pd
-from datetime import datetime, timedelta
+import threading
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tools.credentials import get_login, get_pass
+from tools.files import atomic_write, read_manifest, write_manifest
+from tools.flips import MessageArchive, detect_flips
+from tools.replay import store
+from tools.trading_calendar import trading_days
+from tools.volume import VolumeProvider
 
 
 cwd = os.getcwd()
 user = get_login()
 password = get_pass()
-con = pymysql.connect(host='10.12.1.25', port=3306, database='UsEquitiesL1', user=user, password=password)
-
-
-start = time.time()
-from datetime import date
-d1 = date(2020, 11, 20)
-d2 = date(2020, 12, 10)
-delta = d2 - d1
-
-dates = []
-for i in range(delta.days + 1):
-    current_date = d1 + timedelta(days=i)
-    dates.append(current_date)
-
-for d in dates:
-    start_d = time.time()
-    d = datetime.strftime(d, '%Y-%m-%d')
-    query_imb = "SELECT * FROM " \
-                "(SELECT Symbol, Timestamp, TIME, iPaired, Ask_P, Bid_P, Ask_S, Bid_S, iShares, " \
-                "LAG(iShares,1) OVER ( PARTITION BY Symbol ORDER BY Symbol, msgCnt ) AS PreviShares " \
-                "FROM UsEquitiesL1.`%s` AS t " \
-                "WHERE Reason='Imbalance' " \
-                "AND Ask_P > Bid_P " \
-                "AND TIME>'15:50:00' " \
-                "AND MsgSource='NYSE' " \
-                "AND Symbol IN (SELECT DISTINCT Symbol FROM stock.Stock WHERE `Timestamp` = '%s' AND DailyShares > 2000000 AND EXCHANGE = 'N')) AS T " \
-                "WHERE (((T.iShares > 0) AND (T.PreviShares < 0)) " \
-                "OR ((T.iShares < 0) AND (T.PreviShares > 0)))" % ((d,)*2)
 
+# MySQL error of a day table that doesn't exist, e.g. weekends
+NO_SUCH_TABLE = 1146
+
+imbalances_dir = cwd + '/data/imbalances'
+stock_dir = cwd + '/data/stock'
+manifest_file = imbalances_dir + '/manifest.json'
+
+# Raw Imbalance messages, reversals are detected from them locally
+archive = MessageArchive(cwd + '/data/imbalance_messages')
+# Reversal rules of the query dates extracted before the archive were detected with in MySQL
+default_flips = {'cutoff': '15:50:00', 'venues': ['NYSE'], 'min_shares': 0}
+
+# One connection per extraction thread
+local = threading.local()
+
+
+def get_connection():
+    if store.replaying:
+        # Not needed when queries are replayed
+        return None
+    if getattr(local, 'con', None) is None:
+        local.con = pymysql.connect(host='10.12.1.25', port=3306, database='UsEquitiesL1', user=user,
+                                    password=password)
+    return local.con
+
+
+def drop_connection():
+    """Close the connection of the current thread, the next query reconnects."""
+    con = getattr(local, 'con', None)
+    local.con = None
+    if con is not None:
+        try:
+            con.close()
+        except pymysql.err.Error:
+            pass
+
+
+def missing_table(e):
+    """True if e, or the error it was raised from, is MySQL's unknown table error."""
+    while e is not None:
+        if isinstance(e, pymysql.err.ProgrammingError) and e.args and e.args[0] == NO_SUCH_TABLE:
+            return True
+        e = e.__cause__
+    return False
+
+
+def message_query(d):
+    return "SELECT Symbol, `Timestamp`, TIME, msgCnt, MsgSource, iPaired, Ask_P, Bid_P, Ask_S, Bid_S, iShares " \
+           "FROM UsEquitiesL1.`%s` " \
+           "WHERE Reason='Imbalance' " \
+           "AND Symbol IS NOT NULL AND msgCnt IS NOT NULL AND MsgSource IS NOT NULL" % d
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def load_manifest():
+    """Extracted dates as {date: {'rows', 'md5', 'file'}}, day files saved before the manifest existed are added."""
+    manifest = read_manifest(manifest_file)
+
+    for name in sorted(os.listdir(imbalances_dir)):
+        d = name[:-4]
+        if name.endswith('.csv') and d not in manifest:
+            path = os.path.join(imbalances_dir, name)
+            with open(path, 'rb') as f:
+                rows = sum(1 for _ in f) - 1
+            manifest[d] = {'rows': rows, 'md5': file_md5(path), 'file': name}
+
+    return manifest
+
+
+def typed_chunk(rows, columns):
+    """Frame of a batch of fetched rows with the column types of the message archive.
+
+    MySQL decimals become floats, NULL sizes and prices NaN.
+    """
+    chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    return chunk.astype({c: t for c, t in MessageArchive.columns.items() if c in chunk})
+
+
+def stream_query(query, batch_rows):
+    """Yield the result of query as typed chunks of batch_rows rows, fetched with an unbuffered cursor.
+
+    Only one batch of rows is held by the cursor at a time.
+    """
+    cursor = get_connection().cursor(pymysql.cursors.SSCursor)
     try:
-        df_date = pd.read_sql_query(query_imb, con)
-    except:
-        df_date = pd.DataFrame(data=[])
+        cursor.execute(query)
+        columns = [x[0] for x in cursor.description]
+        while True:
+            batch = cursor.fetchmany(batch_rows)
+            if not batch:
+                break
+            yield typed_chunk(batch, columns)
+    finally:
+        cursor.close()
+
+
+def archive_date(d, batch_rows):
+    """Archive the Imbalance messages and the universe of a date. Returns the number of messages."""
+    query = message_query(d)
+    if store.mode is None:
+        chunks = stream_query(query, batch_rows)
+    else:
+        # Recorded and replayed queries go through the query store as a whole
+        chunks = [store.run(query, None, lambda: pd.read_sql_query(query, get_connection()))]
+    rows = archive.put(d, chunks)
+    if rows:
+        VolumeProvider(get_connection(), stock_dir).get(d)
+
+    return rows
+
+
+def extract_date(d, batch_rows=50000, flips=None):
+    """Save imbalance reversals of all symbols of a date to data/imbalances/<date>.csv.
 
+    Messages of the date are queried once, streamed in batches of batch_rows into the message archive, together with
+    the universe of the date saved to data/stock by VolumeProvider; the backtest filters symbols on it. Reversals are
+    then detected locally with the detect_flips arguments flips, default_flips if not given. Returns the manifest
+    entry of the date, rows is 0 and there is no file if the date has no data.
+    """
+    flips = flips or default_flips
+    # Only messages detect_flips can keep are read from the archive
+    window = {'cutoff': flips['cutoff'], 'venues': flips['venues']}
+    messages = archive.get(d, **window)
+    if messages is None:
+        try:
+            archive_date(d, batch_rows)
+        except Exception as e:
+            if missing_table(e):
+                return {'rows': 0, 'md5': None, 'file': None, 'flips': flips}
+            # The connection may be broken
+            drop_connection()
+            raise
+        messages = archive.get(d, **window)
 
+    df_date = detect_flips(messages, **flips) if messages is not None else pd.DataFrame()
+    path = os.path.join(imbalances_dir, d + '.csv')
     if df_date.empty:
-        print('No data for this date: {}'.format(d))
-        continue
-    df_date.to_csv(cwd + '/data/imbalances/' + d + '.csv')
-    stop_d = time.time()
-    print('Date {} saved. Time: {} seconds'.format(d, stop_d - start_d))
-
-end = time.time()
-print(end - start)
\ No newline at end of file
+        # Reversals of other rules must not be left for the backtest
+        if os.path.exists(path):
+            os.remove(path)
+        return {'rows': 0, 'md5': None, 'file': None, 'flips': flips}
+    atomic_write(path, df_date.to_csv)
+
+    return {'rows': len(df_date), 'md5': file_md5(path), 'file': d + '.csv', 'flips': flips}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract closing imbalance reversals of trading days not extracted yet')
+    parser.add_argument('--start', help='first date, the first extracted date by default')
+    parser.add_argument('--stop', default=pd.Timestamp.today().strftime('%Y-%m-%d'), help='last date, inclusive')
+    parser.add_argument('--workers', type=int, default=4, help='number of dates extracted concurrently')
+    parser.add_argument('--batch-rows', type=int, default=50000, help='messages fetched at a time')
+    parser.add_argument('--cutoff', default=default_flips['cutoff'], help='reversals after this time of day')
+    parser.add_argument('--venues', default=','.join(default_flips['venues']), help='comma separated MsgSource values')
+    parser.add_argument('--min-shares', type=int, default=default_flips['min_shares'],
+                        help='minimum absolute iShares before and after a reversal')
+    parser.add_argument('--force', action='store_true', help='extract dates again even if they are in the manifest')
+    args = parser.parse_args()
+    flips = {'cutoff': args.cutoff, 'venues': args.venues.split(','), 'min_shares': args.min_shares}
+
+    start = time.time()
+    os.makedirs(imbalances_dir, exist_ok=True)
+    manifest = load_manifest()
+    first = args.start or (min(manifest) if manifest else '2020-01-02')
+    # Dates detected with other rules are detected again, from the archive once it has them
+    dates = [d for d in trading_days(first, args.stop)
+             if args.force or d not in manifest or manifest[d].get('flips', default_flips) != flips]
+    print('Trading days to extract: {}'.format(len(dates)))
+
+    today = pd.Timestamp.today().strftime('%Y-%m-%d')
+    saved, empty, failed = [], [], {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(extract_date, d, args.batch_rows, flips): d for d in dates}
+        for future in as_completed(futures):
+            d = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                failed[d] = e
+                print('Date {} failed: {!r}'.format(d, e))
+                continue
+
+            if entry['rows']:
+                saved.append(d)
+                print('Date {} saved. Rows: {}'.format(d, entry['rows']))
+            else:
+                empty.append(d)
+                print('No data for this date: {}'.format(d))
+                if d >= today:
+                    # Data of today may still be loaded, try again next time
+                    continue
+            manifest[d] = entry
+            write_manifest(manifest_file, manifest)
+
+    write_manifest(manifest_file, manifest)
+    end = time.time()
+    print('Saved: {}, no data: {}, failed: {}. Time: {} seconds'.format(len(saved), len(empty), len(failed),
+                                                                       end - start))
+    if failed:
+        print('Failed dates: {}'.format(', '.join(sorted(failed))))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
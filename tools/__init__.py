@@ -1,2 +1,2 @@
 from .credentials import get_pass, get_login
-from .tools import init_logging, get_data, get_prices
\ No newline at end of file
+from .tools import init_logging, get_data, get_prices, get_prices_bulk, get_closes
\ No newline at end of file
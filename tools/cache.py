@@ -0,0 +1,165 @@
+import glob
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from tools.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def hhmmss(datetime_str):
+    """'2020-02-03 15:55:00' -> '155500'"""
+    return datetime_str[-8:].replace(':', '')
+
+
+class TickCache(object):
+    """On-disk cache of tick windows in front of tick.Equities.
+
+    Slices are stored column-wise as <root>/<date>/<symbol>/<start>-<stop>.npz. A window is served from any cached slice
+    of the same symbol and date that covers it. File mtime is the last use, so worker processes can share one cache;
+    once the cache grows over max_bytes, slices used least recently are evicted down to low_water of it. Windows
+    without ticks are not cached, tick.Equities may not have them yet.
+    """
+
+    columns = ['MsgCnt', 'Bid_P', 'Ask_P']
+    # Fraction of max_bytes left after eviction, so the cache tree is only scanned again after many puts
+    low_water = 0.9
+
+    def __init__(self, root, max_bytes=5 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        # Called with (symbol, date) after invalidation
+        self.hooks = []
+        self.size = None
+
+    def on_invalidate(self, hook):
+        """Register hook(symbol, date), called whenever slices are invalidated."""
+        self.hooks.append(hook)
+
+    def slice_path(self, symbol, date, start, stop):
+        return os.path.join(self.root, date, symbol, '{}-{}.npz'.format(hhmmss(start), hhmmss(stop)))
+
+    def get(self, symbol, date, start, stop):
+        """Ticks of symbol with XTime in [start, stop) or None if no cached slice covers the window."""
+        directory = os.path.join(self.root, date, symbol)
+        if not os.path.isdir(directory):
+            return None
+
+        start_key, stop_key = hhmmss(start), hhmmss(stop)
+        covering = []
+        for name in os.listdir(directory):
+            if not name.endswith('.npz'):
+                continue
+            slice_start, slice_stop = name[:-4].split('-')
+            if slice_start <= start_key and stop_key <= slice_stop:
+                covering.append((slice_stop, slice_start, name))
+        if not covering:
+            return None
+
+        # Smallest covering slice
+        path = os.path.join(directory, min(covering)[2])
+        try:
+            with np.load(path) as z:
+                data = {k: z[k] for k in ['time'] + self.columns}
+            os.utime(path)
+        except (IOError, ValueError):
+            # Evicted by another process meanwhile
+            return None
+
+        # XTime has second precision, so [start, stop) on the full timestamp selects the same ticks
+        mask = (data['time'] >= pd.Timestamp(start).value) & (data['time'] < pd.Timestamp(stop).value)
+        ticks = pd.DataFrame({k: data[k][mask] for k in self.columns}, index=pd.DatetimeIndex(data['time'][mask]))
+        ticks.insert(1, 'Symbol', symbol)
+
+        return ticks
+
+    def put(self, symbol, date, start, stop, ticks):
+        """Cache ticks of the window [start, stop), empty windows are left out."""
+        if ticks.empty:
+            return
+        path = self.slice_path(symbol, date, start, stop)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = {'time': ticks.index.values.astype('datetime64[ns]').astype(np.int64),
+                'MsgCnt': np.asarray(ticks['MsgCnt'], dtype=np.int64),
+                'Bid_P': np.asarray(ticks['Bid_P'], dtype=np.float64),
+                'Ask_P': np.asarray(ticks['Ask_P'], dtype=np.float64)}
+
+        atomic_write(path, lambda f: np.savez(f, **data), 'wb')
+
+        if self.size is not None:
+            self.size += os.path.getsize(path)
+        self.evict()
+
+    def files(self):
+        return glob.glob(os.path.join(self.root, '*', '*', '*.npz'))
+
+    def evict(self):
+        """Remove least recently used slices down to low_water of max_bytes once the cache is over max_bytes."""
+        if self.size is None:
+            self.size = sum(os.path.getsize(x) for x in self.files())
+        if self.size <= self.max_bytes:
+            return
+
+        entries = []
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        self.size = sum(x[1] for x in entries)
+        for _, size, path in entries:
+            if self.size <= self.low_water * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+        logger.info('Ticks cache evicted to {} bytes'.format(self.size))
+
+    def invalidate(self, symbol=None, date=None):
+        """Drop cached slices of a symbol and/or date, all slices if neither is given."""
+        for path in glob.glob(os.path.join(self.root, date or '*', symbol or '*', '*.npz')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = None
+
+        for hook in self.hooks:
+            hook(symbol, date)
+
+    def fetch(self, date, windows, get_prices):
+        """Drop-in for get_prices(date, windows): serve cached windows and fetch only the missing ones."""
+        found, missing = [], []
+        for i, (s, start, stop) in enumerate(zip(windows['Symbol'], windows['start'], windows['stop'])):
+            ticks = self.get(s, date, start, stop)
+            if ticks is None:
+                missing.append(i)
+            elif not ticks.empty:
+                found.append(ticks.assign(WindowId=i))
+        logger.info('Ticks cache hits: {}, misses: {}'.format(len(windows) - len(missing), len(missing)))
+
+        if missing:
+            fetched = get_prices(date, windows.iloc[missing].reset_index(drop=True))
+            fetched = dict(list(fetched.groupby('WindowId'))) if not fetched.empty else {}
+            for j, i in enumerate(missing):
+                s, start, stop = windows['Symbol'].iloc[i], windows['start'].iloc[i], windows['stop'].iloc[i]
+                if j not in fetched:
+                    continue
+                ticks = fetched[j]
+                self.put(s, date, start, stop, ticks)
+                ticks = ticks[['MsgCnt', 'Symbol', 'Bid_P', 'Ask_P']].astype(
+                    {'MsgCnt': np.int64, 'Bid_P': np.float64, 'Ask_P': np.float64})
+                found.append(ticks.assign(WindowId=i))
+
+        if not found:
+            return pd.DataFrame()
+
+        return pd.concat(found)
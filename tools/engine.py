@@ -0,0 +1,218 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from tools.exits import apply_exit_rules
+from tools.kernels import asof_join, segment_extremes, segment_ids
+from tools.timers import timers
+
+logger = logging.getLogger(__name__)
+
+
+def get_candidates(df, volume, bt_config, date):
+    """Select the first qualifying reversal of every symbol of a day in one pass.
+
+    df is a day of imbalance reversals from load_imbalances, volume is the day of VolumeProvider indexed by Symbol.
+    Symbols listed on bt_config['exchange'] ('N' by default) with DailyShares over bt_config['minVolume'] make the
+    universe. Returns one row per symbol with the derived columns, entry/exit times and close status.
+    """
+    universe = volume[(volume['DailyShares'] > bt_config['minVolume'])
+                      & (volume['Exchange'] == bt_config.get('exchange', 'N'))]
+    df = df[df['Symbol'].isin(universe.index)].copy()
+    logger.info('Universe filter. Symbols left: {}'.format(df['Symbol'].nunique()))
+
+    # Same as map, also for a categorical Symbol
+    df['volume'] = universe['Shares'].reindex(df['Symbol']).values
+    missing = df['volume'].isnull()
+    if missing.any():
+        logger.info('No volume data for {} symbols'.format(df.loc[missing, 'Symbol'].nunique()))
+        df = df[~missing]
+
+    df['reverse_count'] = df.groupby('Symbol', sort=False, observed=True).cumcount() + 1
+    df['imbBeforeReversePct'] = df['PreviShares'] * 100 / df['volume']
+    df['imbAfterReversePct'] = df['iShares'] * 100 / df['volume']
+    df['deltaImbPct'] = df['imbAfterReversePct'] - df['imbBeforeReversePct']
+
+    df = df[df['deltaImbPct'].abs() > bt_config['absDeltaImbPct']].copy()
+    logger.info('Delta imbalance filter. Symbols left: {}'.format(df['Symbol'].nunique()))
+
+    df['direction'] = np.where(df['deltaImbPct'] > 0, 'Long', 'Short')
+    df['open_price'] = np.where(df['direction'] == 'Long', df['Ask_P'], df['Bid_P'])
+    df['spread_at_open'] = df['Ask_P'] - df['Bid_P']
+
+    df = df[df['spread_at_open'] < bt_config['maxSpread']]
+    logger.info('Spread filter. Symbols left: {}'.format(df['Symbol'].nunique()))
+
+    # Trade only first reversal
+    df = df.groupby('Symbol', sort=False, observed=True).head(1).copy()
+
+    # Filter if start is after market close
+    df = df[df['entry_ns'] < pd.Timestamp(date + ' 15:59:59').value]
+    logger.info('Time entry filter. Symbols left: {}'.format(len(df)))
+    df['start'] = pd.to_datetime(df['entry_ns'])
+
+    return set_exits(df.reset_index(drop=True), bt_config['hold'], date)
+
+
+def set_exits(candidates, hold, date):
+    """Set exit time and close status of candidates held for hold milliseconds, positions are closed at 16:00."""
+    candidates = candidates.copy()
+    market_close = pd.Timestamp(date + ' 16:00:00')
+    candidates['stop'] = candidates['start'] + pd.Timedelta(milliseconds=hold)
+    candidates['close_status'] = np.where(candidates['stop'] > market_close, 'moc', 'market')
+    candidates['stop'] = candidates['stop'].where(candidates['stop'] <= market_close, market_close)
+    # Tick windows are queried with second precision
+    candidates['datetime_start'] = candidates['start'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    candidates['datetime_stop'] = candidates['stop'].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    return candidates
+
+
+def get_windows(candidates):
+    """Tick windows (Symbol, start, stop) of candidates."""
+    return candidates[['Symbol', 'datetime_start', 'datetime_stop']].rename(
+        columns={'datetime_start': 'start', 'datetime_stop': 'stop'})
+
+
+def backtest_day(df, volume, date, bt_config, bp, get_prices, get_closes, exit_grid=None):
+    """Backtest one day of reversals.
+
+    get_prices(date, windows) returns the ticks of all windows tagged with WindowId, get_closes(date) returns the
+    closing prints as {symbol: price}. With exit_grid trades are repeated for every combination of exit rules.
+    """
+    with timers.stage('filter'):
+        candidates = get_candidates(df, volume, bt_config, date)
+
+    # Slice price/market data needed for returns calculation for all candidates at once
+    windows = get_windows(candidates)
+    logger.info('Downloading prices for {} symbols'.format(len(windows)))
+    with timers.stage('tick fetch'):
+        prices = get_prices(date, windows) if len(windows) else pd.DataFrame()
+        prices = dict(list(prices.groupby('WindowId'))) if not prices.empty else {}
+    logger.info('Downloaded prices')
+
+    # Closing prints for positions that run into the close
+    with timers.stage('moc fetch'):
+        closes = get_closes(date) if (candidates['close_status'] == 'moc').any() else {}
+
+    with timers.stage('pnl compute'):
+        return evaluate_trades(candidates, prices, closes, date, bp, exit_grid)
+
+
+def evaluate_trades(candidates, prices, closes, date, bp, exit_grid=None):
+    """Price candidate trades. prices maps candidate position to its tick window, closes maps symbol to MOC price.
+
+    exit_grid holds stop-loss/take-profit/trailing-stop thresholds, see tools.exits.apply_exit_rules.
+    """
+    kept = []
+    paths = []
+    no_prices = no_moc = 0
+    for i, c in enumerate(candidates.itertuples(index=False)):
+        # Slice prices
+        current_prices = prices.get(i)
+        if current_prices is not None:
+            current_prices = current_prices[current_prices.index > c.start]
+
+        if current_prices is None or current_prices.empty:
+            no_prices += 1
+            continue
+
+        if c.close_status == 'moc' and c.Symbol not in closes:
+            no_moc += 1
+            continue
+
+        kept.append(i)
+        paths.append(current_prices)
+
+    logger.info('Trades: {}, no price data: {}, no moc data: {}'.format(len(kept), no_prices, no_moc))
+    if not kept:
+        return []
+
+    trades = candidates.iloc[kept].reset_index(drop=True)
+    ticks = concat_paths(paths)
+    is_long = (trades['direction'] == 'Long').values
+    is_moc = (trades['close_status'] == 'moc').values
+
+    # Prevailing quote at the exit of every trade, windows end at the second of stop
+    exit_pos = asof_join(ticks['key'], ticks['time'], ticks['MsgCnt'], np.arange(len(trades)),
+                         trades['stop'].dt.floor('s').astype('datetime64[ns]').astype(np.int64), strict=True)
+    exit_bid, exit_ask = ticks['Bid_P'][exit_pos], ticks['Ask_P'][exit_pos]
+
+    open_price = trades['open_price'].values
+    close_price = np.where(is_long, exit_bid, exit_ask)
+    moc_close_price = np.where(is_moc, trades['Symbol'].map(closes).astype(np.float64).values, np.nan)
+    spread_at_close = np.where(is_moc, 0, exit_ask - exit_bid)
+
+    # Pnl
+    exit_price = np.where(is_moc, moc_close_price, close_price)
+    delta_move = np.where(is_long, exit_price - open_price, open_price - exit_price)
+    # An empty quote size leaves the trade without a size and pnl
+    position_size = np.where(is_long, trades['Ask_S'].to_numpy(np.float64, na_value=np.nan),
+                             trades['Bid_S'].to_numpy(np.float64, na_value=np.nan))
+    delta_move_pct = delta_move * 100 / open_price
+    position_size_bp = np.minimum(bp / open_price, position_size)
+    position_pnl_bp = delta_move * position_size_bp
+
+    data = []
+    for k, c in enumerate(trades.itertuples(index=False)):
+        d = {'date': date,
+             'symbol': c.Symbol,
+             'volume': c.volume,
+             'start': c.datetime_start,
+             'stop': c.datetime_stop,
+             'initial_imb': c.PreviShares,
+             'paired_imb': c.iPaired,
+             'direction': c.direction,
+             'open_price': c.open_price,
+             'spread_at_open': c.spread_at_open,
+             'close_price': close_price[k],
+             'moc_close_price': moc_close_price[k],
+             'close_status': c.close_status,
+             'spread_at_close': spread_at_close[k],
+             'max_pnl_time': None,
+             'max_pnl_price': None,
+             'min_pnl_time': None,
+             'min_pnl_price': None,
+             'size': position_size_bp[k],
+             'reverse_count': c.reverse_count,
+             'imbBeforeReversePct': c.imbBeforeReversePct,
+             'imbAfterReversePct': c.imbAfterReversePct,
+             'deltaImbPct': c.deltaImbPct,
+             'delta_move': delta_move[k],
+             'delta_move_pct': delta_move_pct[k],
+             'pnl': position_pnl_bp[k]}
+        data.append(d)
+
+    set_extremes(data, ticks)
+    if exit_grid:
+        data = apply_exit_rules(data, ticks, exit_grid)
+
+    return data
+
+
+def concat_paths(paths):
+    """Tick paths of trades laid out back to back as arrays, key is the position of the trade."""
+    offsets = np.concatenate([[0], np.cumsum([len(x) for x in paths])])
+    return {'offsets': offsets,
+            'key': segment_ids(offsets),
+            'time': np.concatenate([x.index.values.astype('datetime64[ns]').astype(np.int64) for x in paths]),
+            'MsgCnt': np.concatenate([np.asarray(x['MsgCnt'], dtype=np.int64) for x in paths]),
+            'Bid_P': np.concatenate([np.asarray(x['Bid_P'], dtype=np.float64) for x in paths]),
+            'Ask_P': np.concatenate([np.asarray(x['Ask_P'], dtype=np.float64) for x in paths])}
+
+
+def set_extremes(data, ticks):
+    """Set high/low market price of trades and the respective times where pnl is max/min considering direction.
+
+    Need this for MAE/MFE analysis to optimize entry and exit timing and potentially stop loss. All trades are
+    reduced at once over their concatenated tick paths.
+    """
+    is_long = np.array([d['direction'] == 'Long' for d in data])
+    best_price, best_time, worst_price, worst_time = segment_extremes(ticks['Bid_P'], ticks['Ask_P'], ticks['time'],
+                                                                      ticks['offsets'], is_long)
+    best_time, worst_time = pd.DatetimeIndex(best_time), pd.DatetimeIndex(worst_time)
+    for k, d in enumerate(data):
+        d['max_pnl_time'] = best_time[k]
+        d['max_pnl_price'] = best_price[k]
+        d['min_pnl_time'] = worst_time[k]
+        d['min_pnl_price'] = worst_price[k]
@@ -0,0 +1,85 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Exit rules in the order they win when several trigger on the same tick
+rules = ['stopLoss', 'takeProfit', 'trailingStop']
+
+
+def path_moves(ticks, open_price, is_long):
+    """Mark price of every tick and its move from the open in percent, positive in favour of the trade."""
+    is_long = np.asarray(is_long)[ticks['key']]
+    open_price = np.asarray(open_price, dtype=np.float64)[ticks['key']]
+    mark = np.where(is_long, ticks['Bid_P'], ticks['Ask_P'])
+    move = np.where(is_long, mark - open_price, open_price - mark) * 100 / open_price
+
+    return mark, move
+
+
+def first_passage(move, ticks, rule, thresholds):
+    """Position of the first tick of every trade that triggers rule for every threshold, n_ticks if it never does.
+
+    Stop-loss triggers once the move falls to -threshold, take-profit once it reaches threshold and trailing-stop once
+    it falls threshold below the best move so far, counting the open. Returns an (n_trades, n_thresholds) array.
+    """
+    thresholds = np.array([np.nan if x is None else x for x in thresholds], dtype=np.float64)
+    if rule == 'stopLoss':
+        hit = move[:, None] <= -thresholds
+    elif rule == 'takeProfit':
+        hit = move[:, None] >= thresholds
+    elif rule == 'trailingStop':
+        peak = np.maximum(pd.Series(move).groupby(ticks['key']).cummax().values, 0)
+        hit = (peak - move)[:, None] >= thresholds
+    else:
+        raise ValueError('Unknown exit rule: {}'.format(rule))
+
+    # None thresholds are nan and never trigger
+    n = len(move)
+    positions = np.where(hit, np.arange(n)[:, None], n)
+
+    return np.minimum.reduceat(positions, ticks['offsets'][:-1], axis=0)
+
+
+def apply_exit_rules(data, ticks, exit_grid):
+    """Re-price trades for every combination of exit rules over their tick paths.
+
+    exit_grid maps rules to lists of thresholds in percent of the open price, like
+    {'stopLoss': [None, 0.5], 'takeProfit': [None, 1], 'trailingStop': [None, 0.3]}, None disables a rule.
+    Every trade is returned once per combination with the rule thresholds. Trades hitting no rule keep their timer or
+    moc exit, others are closed at the mark of the triggering tick with the rule as close_status.
+    """
+    grid = [exit_grid.get(rule, [None]) for rule in rules]
+    combos = list(itertools.product(*[range(len(x)) for x in grid]))
+
+    open_price = [d['open_price'] for d in data]
+    is_long = [d['direction'] == 'Long' for d in data]
+    mark, move = path_moves(ticks, open_price, is_long)
+    first = [first_passage(move, ticks, rule, thresholds) for rule, thresholds in zip(rules, grid)]
+
+    # (n_trades, n_rules, n_combos) first trigger of every rule in every combination
+    exits = np.stack([first[r][:, [c[r] for c in combos]] for r in range(len(rules))], axis=1)
+    triggered = exits.argmin(axis=1)
+    exit_pos = exits.min(axis=1)
+
+    n = len(move)
+    result = []
+    for k, d in enumerate(data):
+        for j, combo in enumerate(combos):
+            trade = dict(d)
+            trade.update({rule: grid[r][combo[r]] for r, rule in enumerate(rules)})
+            pos = exit_pos[k, j]
+            if pos == n:
+                trade['exit_time'] = pd.Timestamp(d['stop'])
+            else:
+                trade['exit_time'] = pd.Timestamp(ticks['time'][pos])
+                trade['close_price'] = mark[pos]
+                trade['moc_close_price'] = np.nan
+                trade['close_status'] = rules[triggered[k, j]]
+                trade['spread_at_close'] = ticks['Ask_P'][pos] - ticks['Bid_P'][pos]
+                delta_move = mark[pos] - d['open_price'] if is_long[k] else d['open_price'] - mark[pos]
+                trade['delta_move'] = delta_move
+                trade['delta_move_pct'] = delta_move * 100 / d['open_price']
+                trade['pnl'] = delta_move * d['size']
+            result.append(trade)
+
+    return result
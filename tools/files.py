@@ -0,0 +1,33 @@
+import json
+import os
+import threading
+
+
+def atomic_write(path, write, mode='w'):
+    """Write path with write(f) on a temporary file that replaces path once complete.
+
+    Readers, e.g. other processes or the imbalance watcher, and interrupted runs never see a half written file. The
+    temporary file is unique per process and thread and removed if write fails.
+    """
+    tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        # Line endings are left to the writer, as pandas expects
+        with open(tmp, mode, **({} if 'b' in mode else {'newline': ''})) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read_manifest(path):
+    """Manifest of a store as a dict, empty if there is none yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    atomic_write(path, lambda f: json.dump(manifest, f, indent=1, sort_keys=True))
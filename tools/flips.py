@@ -0,0 +1,165 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+class MessageArchive(object):
+    """Raw Imbalance messages of a day stored column-wise in <root>/<date>/.
+
+    Every column is a raw array file <column>.bin appended to chunk by chunk as rows arrive, so a day is never held in
+    memory whole. Symbol and MsgSource are int32 codes into their sorted distinct values, listed with the row count in
+    meta.json. The time of a message (Timestamp date plus TIME) is int64 nanoseconds. Sizes and prices are float64,
+    NULLs of message classes the detection drops survive as NaN.
+    """
+
+    labels = ['Symbol', 'MsgSource']
+    columns = {'msgCnt': np.int64, 'iPaired': np.float64, 'Ask_S': np.float64, 'Bid_S': np.float64,
+               'iShares': np.float64, 'Ask_P': np.float64, 'Bid_P': np.float64}
+    # Rows of codes remapped at a time once a day is complete
+    block = 1 << 20
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, date):
+        return os.path.join(self.root, date)
+
+    def get(self, date, cutoff=None, venues=None):
+        """Messages of a date with categorical Symbol and MsgSource and a datetime time, None if not archived.
+
+        Only messages after the time of day cutoff and from venues are read if given. The filter runs block by block on
+        memory mapped time and MsgSource columns, so a day is never loaded whole.
+        """
+        path = self.path(date)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        def column(name, dtype):
+            return np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r')
+
+        rows = meta['rows']
+        keep = np.ones(rows, dtype=bool)
+        if venues is not None:
+            codes = [i for i, x in enumerate(meta['values']['MsgSource']) if x in venues]
+            source = column('MsgSource', np.int32)
+            for i in range(0, rows, self.block):
+                keep[i:i + self.block] &= np.isin(source[i:i + self.block], codes)
+        if cutoff is not None:
+            day_ns, cutoff_ns = pd.Timedelta(days=1).value, pd.Timedelta(cutoff).value
+            time = column('time', np.int64)
+            for i in range(0, rows, self.block):
+                keep[i:i + self.block] &= time[i:i + self.block] % day_ns > cutoff_ns
+        index = np.flatnonzero(keep)
+
+        def read(name, dtype):
+            return np.asarray(column(name, dtype)[index])
+
+        df = pd.DataFrame({x: pd.Categorical.from_codes(read(x, np.int32), meta['values'][x]) for x in self.labels})
+        df['time'] = pd.to_datetime(read('time', np.int64))
+        for c, dtype in self.columns.items():
+            df[c] = read(c, dtype)
+
+        return df
+
+    def put(self, date, chunks):
+        """Archive a date from frames of query rows, each one written out before the next is read.
+
+        Returns the number of messages. Nothing is kept for a date without messages.
+        """
+        # Written to a temporary directory first so readers never see a half written day
+        tmp = self.path(date) + '.{}.tmp'.format(os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        codes = {x: {} for x in self.labels}
+        rows = 0
+        try:
+            names = ['time'] + self.labels + list(self.columns)
+            files = {x: open(os.path.join(tmp, x + '.bin'), 'wb') for x in names}
+            try:
+                for chunk in chunks:
+                    time = pd.to_datetime(chunk['Timestamp']) + pd.to_timedelta(chunk['TIME'])
+                    files['time'].write(time.values.astype('datetime64[ns]').astype(np.int64).tobytes())
+                    for x in self.labels:
+                        # Codes in order of appearance, sorted once all chunks are written
+                        for value in chunk[x].unique():
+                            codes[x].setdefault(value, len(codes[x]))
+                        files[x].write(chunk[x].map(codes[x]).values.astype(np.int32).tobytes())
+                    for c, dtype in self.columns.items():
+                        files[c].write(np.asarray(chunk[c], dtype=dtype).tobytes())
+                    rows += len(chunk)
+            finally:
+                for f in files.values():
+                    f.close()
+
+            if not rows:
+                shutil.rmtree(tmp)
+                return 0
+
+            meta = {'rows': rows, 'values': {}}
+            for x in self.labels:
+                values = np.array(list(codes[x]), dtype=str)
+                order = np.argsort(values)
+                rank = np.empty(len(order), dtype=np.int32)
+                rank[order] = np.arange(len(order))
+                array = np.memmap(os.path.join(tmp, x + '.bin'), dtype=np.int32, mode='r+')
+                for i in range(0, rows, self.block):
+                    array[i:i + self.block] = rank[array[i:i + self.block]]
+                array.flush()
+                del array
+                meta['values'][x] = values[order].tolist()
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        os.replace(tmp, self.path(date))
+
+        return rows
+
+
+def detect_flips(messages, cutoff='15:50:00', venues=('NYSE',), min_shares=0):
+    """Imbalance reversals of a day of messages from MessageArchive, in the schema of data/imbalances.
+
+    Messages with a locked or crossed quote, at or before cutoff or from other venues are dropped first. Every message
+    left is compared with the previous one of its symbol in msgCnt order, a reversal is a change of the sign of
+    iShares, with both sizes at least min_shares. The defaults reproduce the query get_data.py used to run in MySQL.
+    """
+    time = messages['time']
+    time_of_day = time - time.dt.normalize()
+    mask = ((messages['Ask_P'] > messages['Bid_P']) & (time_of_day > pd.Timedelta(cutoff))
+            & messages['MsgSource'].isin(list(venues)))
+    df = messages[mask.values]
+
+    symbols = pd.factorize(df['Symbol'], sort=True)[0]
+    df = df.iloc[np.lexsort((df['msgCnt'].values, symbols))]
+    symbols = np.sort(symbols)
+
+    shares = df['iShares'].values
+    previous = np.full(len(df), np.nan)
+    previous[1:] = shares[:-1]
+    # The first message of a symbol has no previous one and can't be a reversal, neither can NULL sizes
+    first = np.ones(len(df), dtype=bool)
+    first[1:] = symbols[1:] != symbols[:-1]
+    previous[first] = np.nan
+
+    flip = ((shares > 0) & (previous < 0)) | ((shares < 0) & (previous > 0))
+    if min_shares:
+        flip &= (np.abs(shares) >= min_shares) & (np.abs(previous) >= min_shares)
+
+    df = df[flip]
+    time = df['time']
+    return pd.DataFrame({'Symbol': df['Symbol'].astype(str).values,
+                         'Timestamp': time.dt.strftime('%Y-%m-%d').values,
+                         'TIME': (time - time.dt.normalize()).values,
+                         'iPaired': pd.array(df['iPaired'].values, dtype='Int64'),
+                         'Ask_P': df['Ask_P'].values,
+                         'Bid_P': df['Bid_P'].values,
+                         'Ask_S': pd.array(df['Ask_S'].values, dtype='Int64'),
+                         'Bid_S': pd.array(df['Bid_S'].values, dtype='Int64'),
+                         'iShares': shares[flip].astype(np.int64),
+                         'PreviShares': previous[flip].astype(np.int64)})
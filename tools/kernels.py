@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+
+def segment_ids(offsets):
+    """Segment number of every element of segments laid out back to back, offsets has n_segments + 1 items."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def segment_extremes(bid, ask, times, offsets, is_long):
+    """Best and worst mark price of every trade over its tick path and the time it was first reached.
+
+    Ticks of all trades are concatenated, trade k owns ticks offsets[k]:offsets[k + 1] and must have at least one.
+    Longs are marked on bid, shorts on ask. Returns best_price, best_time, worst_price, worst_time arrays.
+    """
+    starts = offsets[:-1]
+    seg = segment_ids(offsets)
+    long_tick = np.asarray(is_long)[seg]
+    mark = np.where(long_tick, bid, ask)
+    # Higher is better for both directions
+    signed = np.where(long_tick, mark, -mark)
+
+    best = np.maximum.reduceat(signed, starts)
+    worst = np.minimum.reduceat(signed, starts)
+
+    # First position reaching the extreme, like idxmax/idxmin
+    positions = np.arange(len(mark))
+    best_pos = np.minimum.reduceat(np.where(signed == best[seg], positions, len(mark)), starts)
+    worst_pos = np.minimum.reduceat(np.where(signed == worst[seg], positions, len(mark)), starts)
+
+    return mark[best_pos], times[best_pos], mark[worst_pos], times[worst_pos]
+
+
+def asof_join(tick_keys, tick_times, tick_seq, query_keys, query_times, strict=False):
+    """Position of the tick prevailing at every query, -1 where the key has no tick by then.
+
+    Ticks are ordered by key, time and sequence number (MsgCnt) so the last message wins on equal times, and every
+    (key, time) query is resolved with one binary search on a combined key. Keys may repeat across queries, e.g. to
+    price several exit times of the same trade. With strict only ticks before the query time are considered.
+    """
+    tick_times = np.asarray(tick_times, dtype=np.int64)
+    query_times = np.asarray(query_times, dtype=np.int64)
+    if not len(tick_times):
+        return np.full(len(query_times), -1, dtype=np.int64)
+
+    codes, uniques = pd.factorize(np.concatenate([np.asarray(tick_keys), np.asarray(query_keys)]))
+    tick_codes, query_codes = codes[:len(tick_times)].astype(np.int64), codes[len(tick_times):].astype(np.int64)
+
+    t0 = tick_times.min()
+    # One spare offset on each side of the ticks for queries out of their range
+    span = int(tick_times.max() - t0) + 2
+    if len(uniques) * span >= np.iinfo(np.int64).max:
+        raise ValueError('Ticks span too long to combine {} keys'.format(len(uniques)))
+
+    order = np.lexsort((np.asarray(tick_seq), tick_times, tick_codes))
+    combined = tick_codes[order] * span + (tick_times[order] - t0)
+    # Queries before the first tick land on the previous key, the key check below drops them
+    query = query_codes * span + np.clip(query_times - t0, -1, span - 1)
+
+    pos = np.searchsorted(combined, query, side='left' if strict else 'right') - 1
+    found = pos >= 0
+    found[found] = tick_codes[order[pos[found]]] == query_codes[found]
+
+    return np.where(found, order[np.maximum(pos, 0)], -1)
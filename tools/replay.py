@@ -0,0 +1,74 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+from tools.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(query):
+    """Query text with whitespace collapsed, so formatting doesn't change its key."""
+    return ' '.join(query.split())
+
+
+def query_key(query, params=None, external_tables=None):
+    """Hash of a normalized query, its parameters and external tables data."""
+    payload = json.dumps({'query': normalize(query), 'params': params, 'external_tables': external_tables},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class QueryStore(object):
+    """Record/replay of database queries.
+
+    In record mode results of queries are saved to <root>/<key[:2]>/<key>.pkl together with the query text and
+    parameters. In replay mode they are served from there and the database is never touched, a query that was not
+    recorded raises LookupError. Without a mode queries just run.
+    """
+
+    def __init__(self, root, mode=None):
+        if mode not in (None, 'record', 'replay'):
+            raise ValueError('Unknown replay mode: {}'.format(mode))
+        self.root = root
+        self.mode = mode
+
+    @classmethod
+    def from_env(cls):
+        """Store configured by BACKTEST_REPLAY (record or replay) and BACKTEST_REPLAY_DIR."""
+        return cls(os.environ.get('BACKTEST_REPLAY_DIR', os.path.join(os.getcwd(), 'data', 'replay')),
+                   os.environ.get('BACKTEST_REPLAY') or None)
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + '.pkl')
+
+    def run(self, query, params, fetch, external_tables=None):
+        """Result of fetch(), the function running query with params, recorded or replayed depending on the mode."""
+        if self.mode is None:
+            return fetch()
+
+        key = query_key(query, params, external_tables)
+        path = self.path(key)
+        if self.mode == 'replay':
+            if not os.path.exists(path):
+                raise LookupError('Query not recorded: {} {}'.format(key, normalize(query)[:200]))
+            with open(path, 'rb') as f:
+                return pickle.load(f)['result']
+
+        result = fetch()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {'query': normalize(query), 'params': params, 'result': result}
+        atomic_write(path, lambda f: pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+        logger.debug('Recorded query {}'.format(key))
+
+        return result
+
+
+# Shared by all queries of the process
+store = QueryStore.from_env()
@@ -0,0 +1,45 @@
+import os
+import pandas as pd
+
+from tools.files import atomic_write, read_manifest, write_manifest
+
+
+class ResultsWriter(object):
+    """Append-only store of backtest positions partitioned by date.
+
+    Every date is written once to <root>/<date>.csv, manifest.json keeps completed dates with their row counts.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_file = os.path.join(root, 'manifest.json')
+        os.makedirs(root, exist_ok=True)
+        self.manifest = read_manifest(self.manifest_file)
+
+    def write_day(self, date, trades):
+        """Save trades of a date and mark the date completed."""
+        file_name = None
+        if trades:
+            file_name = date + '.csv'
+            path = os.path.join(self.root, file_name)
+            atomic_write(path, lambda f: pd.DataFrame(trades).to_csv(f, index=False))
+
+        self.manifest[date] = {'rows': len(trades), 'file': file_name}
+        write_manifest(self.manifest_file, self.manifest)
+
+    def completed(self):
+        return set(self.manifest)
+
+    def iter_days(self, dates=None):
+        """Yield (date, positions) of completed dates in date order."""
+        for date in sorted(self.manifest if dates is None else set(dates) & set(self.manifest)):
+            file_name = self.manifest[date]['file']
+            if file_name is not None:
+                yield date, pd.read_csv(os.path.join(self.root, file_name))
+
+    def load(self, dates=None):
+        """Consolidated positions of all (or the given) completed dates."""
+        days = [positions for _, positions in self.iter_days(dates)]
+        if not days:
+            return pd.DataFrame()
+        return pd.concat(days, ignore_index=True)
@@ -0,0 +1,64 @@
+import itertools
+import logging
+import pandas as pd
+
+from tools.engine import get_candidates, set_exits, get_windows, evaluate_trades
+from tools.timers import timers
+
+logger = logging.getLogger(__name__)
+
+
+def expand_grid(grid):
+    """All configs of a grid like {'hold': [30000, 60000], 'maxSpread': [0.1, 0.2], ...}."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+
+def sweep_day(df, volume, date, configs, bp, get_prices, get_closes, exit_grid=None):
+    """Backtest one day for many configs from a single data pass.
+
+    Every distinct entry gets one tick window long enough for the longest hold, shorter holds are cut from it.
+    Trades are returned with the config they belong to, and with their exit rules if exit_grid is given.
+    """
+    max_hold = max(config['hold'] for config in configs)
+
+    def entry_key(config):
+        # Entries depend on universe and filter thresholds only, exits on hold
+        return config['minVolume'], config.get('exchange', 'N'), config['maxSpread'], config['absDeltaImbPct']
+
+    entries = {}
+    for config in configs:
+        key = entry_key(config)
+        if key not in entries:
+            with timers.stage('filter'):
+                entries[key] = get_candidates(df, volume, dict(config, hold=max_hold), date)
+
+    windows = pd.concat(entries.values()).drop_duplicates(['Symbol', 'start']).reset_index(drop=True)
+    window_ids = {(s, start): i for i, (s, start) in enumerate(zip(windows['Symbol'], windows['start']))}
+    logger.info('Downloading prices for {} entries of {} configs'.format(len(windows), len(configs)))
+    with timers.stage('tick fetch'):
+        prices = get_prices(date, get_windows(windows)) if len(windows) else pd.DataFrame()
+        prices = dict(list(prices.groupby('WindowId'))) if not prices.empty else {}
+    logger.info('Downloaded prices')
+
+    closes = None
+    data = []
+    for config in configs:
+        candidates = set_exits(entries[entry_key(config)], config['hold'], date)
+        if closes is None and (candidates['close_status'] == 'moc').any():
+            with timers.stage('moc fetch'):
+                closes = get_closes(date)
+
+        config_prices = {}
+        for i, (s, start, stop) in enumerate(zip(candidates['Symbol'], candidates['start'], candidates['stop'])):
+            window = prices.get(window_ids[(s, start)])
+            if window is not None:
+                # Same second precision bound a window queried for this hold would have
+                config_prices[i] = window[window.index < stop.floor('s')]
+
+        with timers.stage('pnl compute'):
+            for d in evaluate_trades(candidates, config_prices, closes or {}, date, bp, exit_grid):
+                d.update(config)
+                data.append(d)
+
+    return data
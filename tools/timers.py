@@ -0,0 +1,75 @@
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import pandas as pd
+
+# Latency histogram buckets are powers of two of microseconds, the last one takes everything above ~35 minutes
+n_buckets = 32
+
+
+class Timers(object):
+    """In-memory stage timers: call counts, total time and a log2 latency histogram per named stage.
+
+    Time a block with `with timers.stage('tick fetch'):`. A disabled instance hands out a shared no-op context, so
+    instrumentation can stay in the hot path.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        # name: [count, total seconds, histogram]
+        self.stages = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Record one timing of a stage."""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = [0, 0.0, np.zeros(n_buckets, dtype=np.int64)]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2][min(int(seconds * 1e6).bit_length(), n_buckets - 1)] += 1
+
+    def merge(self, stages):
+        """Add the stages of another Timers, e.g. one of a worker process."""
+        for name, (count, total, hist) in stages.items():
+            stats = self.stages.setdefault(name, [0, 0.0, np.zeros(n_buckets, dtype=np.int64)])
+            stats[0] += count
+            stats[1] += total
+            stats[2] += hist
+
+    def summary(self):
+        """Table of stages in order of first use with count, total, mean and approximate p50/p99 in seconds.
+
+        Quantiles are upper bounds of the histogram bucket they fall into.
+        """
+        rows = []
+        upper = 2.0 ** np.arange(n_buckets) / 1e6
+        for name, (count, total, hist) in self.stages.items():
+            cum = np.cumsum(hist)
+            rows.append({'stage': name,
+                         'count': count,
+                         'total': total,
+                         'mean': total / count,
+                         'p50': upper[np.searchsorted(cum, 0.5 * count)],
+                         'p99': upper[np.searchsorted(cum, 0.99 * count)]})
+
+        return pd.DataFrame(rows, columns=['stage', 'count', 'total', 'mean', 'p50', 'p99']).set_index('stage')
+
+
+# Shared by the backtest modules of a process
+timers = Timers()
@@ -1,11 +1,24 @@
 import logging
+import os
+import numpy as np
 import pandas as pd
 import pymysql
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from tools.credentials import get_login, get_pass
+from tools.files import atomic_write
 from clickhouse_driver.pandasConnector import pandasConnector as clickConn
+from clickhouse_driver.pool import ClientPool
+from tools.replay import store
 
-con = pymysql.connect(host='10.12.1.25', port=3306, database='UsEquitiesL1', user=get_login(), password=get_pass())
+# MySQL connection, opened on first use so importing tools needs no database
+con = None
+
+# Shared by all tick queries of the process
+click_pool = ClientPool(host="10.12.1.60", database="tick", user='quant', password='quant')
+
+# NYSE closing prints by date: {date: {symbol: price}}
+closes_cache = {}
 
 
 def init_logging(log_file=None, append=False, console_loglevel=logging.INFO):
@@ -34,25 +47,60 @@ def init_logging(log_file=None, append=False, console_loglevel=logging.INFO):
     return logging.getLogger(__name__)
 
 
+def mysql_connection():
+    """Connection to the UsEquitiesL1 MySQL database shared by the process."""
+    global con
+    if con is None:
+        con = pymysql.connect(host='10.12.1.25', port=3306, database='UsEquitiesL1', user=get_login(),
+                              password=get_pass())
+    return con
+
+
 def get_data(query, params):
     try:
-        data = pd.read_sql_query(query, con, params)
+        data = store.run(query, params, lambda: pd.read_sql_query(query, mysql_connection(), params))
     except:
         data = pd.DataFrame(data=[])
 
     return data
 
 
+@contextmanager
+def click_connection():
+    """Check out a pooled ClickHouse connection to the tick database."""
+    with click_pool.client() as client:
+        yield clickConn(host="10.12.1.60", db="tick", client=client)
+
+
+def tick_index(seconds, micros, timezone=None):
+    """DatetimeIndex of ticks from XTime epoch seconds and XTimeMicro, in server local time like toString(XTime)."""
+    ns = np.asarray(seconds, dtype=np.int64) * 1000000000 + np.asarray(micros, dtype=np.int64) * 1000
+    index = pd.DatetimeIndex(ns.astype('datetime64[ns]'))
+    if timezone and timezone != 'UTC':
+        index = index.tz_localize('UTC').tz_convert(timezone).tz_localize(None)
+
+    return index
+
+
+def click_query(query, tableName, external_tables=None):
+    """Result of a tick database query and the server timezone, recorded/replayed by tools.replay.store."""
+    def fetch():
+        with click_connection() as con:
+            return con.read_sql_query(query, tableName=tableName, external_tables=external_tables), \
+                   con.server_timezone()
+
+    return store.run(query, None, fetch, external_tables)
+
+
 def get_prices(symbol, date, datetime_start, datetime_stop):
-    con = clickConn(host="10.12.1.60", db="tick", user='quant', password='quant')
-    prices = con.read_sql_query("SELECT toString(XTime) as Time, XTimeMicro as TimeMicro, MsgCnt, Symbol, Bid_P, Ask_P "
-                                "FROM tick.Equities "
-                                "WHERE Symbol = '%s' "
-                                "AND TradeDate='%s' "
-                                "AND toDateTime(XTime)>=toDateTime('%s') "
-                                "AND toDateTime(XTime)<toDateTime('%s') "
-                                "ORDER BY XTime, MsgCnt ASC" % (symbol, date, datetime_start, datetime_stop),
-                                tableName='Equities')
+    prices, timezone = click_query("SELECT toUInt32(XTime) as Time, XTimeMicro as TimeMicro, MsgCnt, Bid_P, Ask_P "
+                                   "FROM tick.Equities "
+                                   "WHERE Symbol = '%s' "
+                                   "AND TradeDate='%s' "
+                                   "AND toDateTime(XTime)>=toDateTime('%s') "
+                                   "AND toDateTime(XTime)<toDateTime('%s') "
+                                   "ORDER BY XTime, MsgCnt ASC" % (symbol, date, datetime_start, datetime_stop),
+                                   tableName='Equities')
 
     df_prices = pd.DataFrame(prices)
 
@@ -61,24 +109,94 @@ def get_prices(symbol, date, datetime_start, datetime_stop):
         return df_prices
 
     else:
-        df_prices['TimeMicro'] = df_prices['TimeMicro'].astype(str).str.zfill(6)
-        df_prices['Time'] = df_prices['Time'].astype(str) + '.' + df_prices['TimeMicro'].astype(str)
-        df_prices.index = pd.to_datetime(df_prices['Time'])
+        df_prices.index = tick_index(df_prices.pop('Time'), df_prices.pop('TimeMicro'), timezone)
 
         return df_prices
 
 
 def get_close(symbol, date):
-    con = clickConn(host="10.12.1.60", db="tick", user='quant', password='quant')
-    prices = con.read_sql_query("SELECT toString(XTime) as Time, XTimeMicro as TimeMicro, MsgCnt, Symbol, tPrice " 
-                                "FROM tick.Equities " 
-                                "WHERE Symbol = '%s' " 
-                                "AND TradeDate='%s' " 
-                                "AND tType='CLX' " 
-                                "AND tVenue='NYSE' " 
-                                "ORDER BY XTime, MsgCnt ASC" % (symbol, date),
+    prices, _ = click_query("SELECT toString(XTime) as Time, XTimeMicro as TimeMicro, MsgCnt, Symbol, tPrice "
+                            "FROM tick.Equities "
+                            "WHERE Symbol = '%s' "
+                            "AND TradeDate='%s' "
+                            "AND tType='CLX' "
+                            "AND tVenue='NYSE' "
+                            "ORDER BY XTime, MsgCnt ASC" % (symbol, date),
+                            tableName='Equities')
+
+    df_prices = pd.DataFrame(prices)
+
+    if df_prices.empty:
+
+        return df_prices
+
+    else:
+
+        return df_prices
+
+
+def get_closes(date, cache_dir=None):
+    """Get NYSE closing cross prices of all symbols for a date as {symbol: price}.
+
+    Prints are fetched with one query, kept in memory and, if cache_dir is given, saved to cache_dir/<date>.csv. Days
+    without prints are neither kept nor saved.
+    """
+    if date in closes_cache:
+        return closes_cache[date]
+
+    cache_file = os.path.join(cache_dir, date + '.csv') if cache_dir is not None else None
+    if cache_file is not None and os.path.exists(cache_file):
+        df_closes = pd.read_csv(cache_file)
+    else:
+        prices, _ = click_query("SELECT Symbol, tPrice "
+                                "FROM tick.Equities "
+                                "WHERE TradeDate='%s' "
+                                "AND tType='CLX' "
+                                "AND tVenue='NYSE' "
+                                "ORDER BY Symbol, XTime, MsgCnt ASC" % date,
                                 tableName='Equities')
 
+        df_closes = pd.DataFrame(prices, columns=['Symbol', 'tPrice'])
+        # First closing print of a symbol, same as get_close
+        df_closes = df_closes.drop_duplicates('Symbol')
+        df_closes['tPrice'] = pd.to_numeric(df_closes['tPrice'])
+
+        # Don't persist empty days, data can be loaded later
+        if cache_file is not None and not df_closes.empty:
+            os.makedirs(cache_dir, exist_ok=True)
+            atomic_write(cache_file, lambda f: df_closes.to_csv(f, index=False))
+
+    closes = dict(zip(df_closes['Symbol'], df_closes['tPrice']))
+    # Nor remember them, a long running --watch process queries them again
+    if closes:
+        closes_cache[date] = closes
+
+    return closes
+
+
+def get_prices_bulk(date, windows):
+    """Fetch ticks for all (Symbol, start, stop) windows of a date with one query.
+
+    Windows are shipped to the server as an external table. Every returned tick carries the Symbol and the WindowId
+    (row position in windows) it belongs to.
+    """
+    external_tables = [{'name': 'windows',
+                        'structure': [('WindowId', 'UInt32'), ('Symbol', 'String'),
+                                      ('WindowStart', 'String'), ('WindowStop', 'String')],
+                        'data': [[i, str(s), str(start), str(stop)] for i, (s, start, stop) in
+                                 enumerate(zip(windows['Symbol'], windows['start'], windows['stop']))]}]
+
+    prices, timezone = click_query("SELECT WindowId, toUInt32(XTime) as Time, XTimeMicro as TimeMicro, MsgCnt, "
+                                   "Bid_P, Ask_P "
+                                   "FROM tick.Equities "
+                                   "ALL INNER JOIN windows USING Symbol "
+                                   "WHERE TradeDate='%s' "
+                                   "AND Symbol IN (SELECT Symbol FROM windows) "
+                                   "AND toDateTime(XTime)>=toDateTime(WindowStart) "
+                                   "AND toDateTime(XTime)<toDateTime(WindowStop) "
+                                   "ORDER BY WindowId, XTime, MsgCnt ASC" % date,
+                                   tableName='Equities', external_tables=external_tables)
+
     df_prices = pd.DataFrame(prices)
 
     if df_prices.empty:
@@ -86,5 +204,8 @@ def get_close(symbol, date):
         return df_prices
 
     else:
+        df_prices.index = tick_index(df_prices.pop('Time'), df_prices.pop('TimeMicro'), timezone)
+        # Symbols come from the windows rather than over the wire
+        df_prices.insert(1, 'Symbol', np.asarray(windows['Symbol'])[df_prices['WindowId'].values])
 
         return df_prices
@@ -0,0 +1,34 @@
+import pandas as pd
+from pandas.tseries.holiday import (AbstractHolidayCalendar, Holiday, GoodFriday, USMartinLutherKingJr,
+                                    USPresidentsDay, USMemorialDay, USLaborDay, USThanksgivingDay,
+                                    nearest_workday, sunday_to_monday)
+from pandas.tseries.offsets import CustomBusinessDay
+
+# Full day closures outside of the regular holiday rules
+special_closures = ['2012-10-29', '2012-10-30', '2018-12-05', '2025-01-09']
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Full day NYSE holidays. New Year's Day on a Saturday is not observed on the Friday before."""
+
+    rules = [
+        Holiday('New Years Day', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-01-01', observance=nearest_workday),
+        Holiday('Independence Day', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ] + [Holiday('Closure ' + x, year=int(x[:4]), month=int(x[5:7]), day=int(x[8:])) for x in special_closures]
+
+
+# Holidays of the calendar are computed once, that takes tens of milliseconds
+trading_day = CustomBusinessDay(calendar=NYSEHolidayCalendar())
+
+
+def trading_days(start, stop):
+    """NYSE trading days from start to stop inclusive as 'YYYY-MM-DD' strings."""
+    return pd.date_range(start, stop, freq=trading_day).strftime('%Y-%m-%d')
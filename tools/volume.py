@@ -0,0 +1,90 @@
+import logging
+import os
+import pandas as pd
+
+from tools.files import atomic_write
+from tools.replay import store
+from tools.trading_calendar import trading_days
+
+logger = logging.getLogger(__name__)
+
+
+class VolumeProvider(object):
+    """Daily volumes and listing exchange from stock.Stock indexed by symbol, one frame per date.
+
+    Only the columns the backtest needs are fetched. load() brings a whole date range in one query. With a root
+    directory every date with data is also kept as <root>/<date>.csv, so the universe of a date is queried once and
+    shared by get_data.py and the backtest; universe filters run on these frames.
+    """
+
+    query = "SELECT `Timestamp`, Symbol, Shares, DailyShares, Exchange " \
+            "FROM stock.Stock " \
+            "WHERE `Timestamp` BETWEEN %(start)s AND %(stop)s"
+
+    columns = ['Shares', 'DailyShares', 'Exchange']
+
+    def __init__(self, con, root=None):
+        self.con = con
+        self.root = root
+        self.days = {}
+
+    def path(self, date):
+        return os.path.join(self.root, date + '.csv')
+
+    def empty(self):
+        return pd.DataFrame({'Shares': pd.Series(dtype=float), 'DailyShares': pd.Series(dtype=float),
+                             'Exchange': pd.Series(dtype=object)}, index=pd.Index([], name='Symbol'))
+
+    def read_local(self, date):
+        """Load a date saved under root. Returns False if it isn't there."""
+        if self.root is None or not os.path.exists(self.path(date)):
+            return False
+        # 'NA' and similar are symbols, not missing values
+        self.days[date] = pd.read_csv(self.path(date), index_col='Symbol', keep_default_na=False,
+                                      na_values={c: [''] for c in self.columns},
+                                      dtype={'Symbol': str, 'Shares': float, 'DailyShares': float, 'Exchange': str})
+        return True
+
+    def save_local(self, date):
+        os.makedirs(self.root, exist_ok=True)
+        atomic_write(self.path(date), self.days[date][self.columns].to_csv)
+
+    def fetch(self, start, stop):
+        """Rows of stock.Stock from start to stop inclusive."""
+        params = {'start': start, 'stop': stop}
+        return store.run(self.query, params, lambda: pd.read_sql_query(self.query, self.con, params=params))
+
+    def load(self, start, stop):
+        """Index all trading days from start to stop inclusive, fetching those not saved locally in one query."""
+        self.load_days(list(trading_days(start, stop)))
+
+    def load_days(self, dates):
+        """Index dates, those neither in memory nor saved locally are fetched with one query.
+
+        Dates without data are neither remembered nor saved, stock.Stock may not be loaded for them yet.
+        """
+        missing = [x for x in dates if x not in self.days and not self.read_local(x)]
+        if not missing:
+            return
+
+        logger.info('Downloading volume data from {} to {}'.format(missing[0], missing[-1]))
+        df = self.fetch(missing[0], missing[-1])
+        logger.info('Downloaded volume data. Rows: {}'.format(len(df)))
+
+        df['Timestamp'] = pd.to_datetime(df['Timestamp']).dt.strftime('%Y-%m-%d')
+        for date, day in df.groupby('Timestamp'):
+            if date not in missing:
+                continue
+            # Last row of a symbol wins, as with .iloc[-1] on the raw query result
+            self.days[date] = day.drop_duplicates('Symbol', keep='last').set_index('Symbol')[self.columns]
+            if self.root is not None:
+                self.save_local(date)
+
+    def get(self, date):
+        """Volume data of a date indexed by Symbol, empty if stock.Stock has none.
+
+        The date is fetched even if it isn't a trading day of the calendar.
+        """
+        if date not in self.days:
+            self.load_days([date])
+        return self.days.get(date, self.empty())
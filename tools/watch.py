@@ -0,0 +1,71 @@
+import glob
+import logging
+import os
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def watch_files(directory, pattern='*.csv', interval=1.0):
+    """Yield lists of new files matching pattern as they land in directory.
+
+    The first list holds the files already there. After that an empty list is yielded every interval seconds
+    without changes, so callers can do other work between files. Uses watchdog notifications when installed and
+    falls back to checking the directory mtime.
+    """
+    seen = set()
+
+    def scan():
+        new = sorted(x for x in glob.glob(os.path.join(directory, pattern)) if x not in seen)
+        seen.update(new)
+        return new
+
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        Observer = None
+
+    if Observer is None:
+        logger.info('Watching {} with directory mtime checks'.format(directory))
+        # Take mtime before the first scan to not miss files landing in between
+        mtime = os.stat(directory).st_mtime_ns
+        yield scan()
+        while True:
+            time.sleep(interval)
+            current = os.stat(directory).st_mtime_ns
+            if current != mtime:
+                mtime = current
+                yield scan()
+            else:
+                yield []
+
+    events = queue.Queue()
+
+    class Handler(FileSystemEventHandler):
+        def on_created(self, event):
+            events.put(event.src_path)
+
+        def on_moved(self, event):
+            events.put(event.dest_path)
+
+    logger.info('Watching {} with filesystem notifications'.format(directory))
+    observer = Observer()
+    observer.schedule(Handler(), directory)
+    observer.start()
+    try:
+        yield scan()
+        while True:
+            try:
+                events.get(timeout=interval)
+            except queue.Empty:
+                yield []
+                continue
+            # Drain events of files landing together
+            while not events.empty():
+                events.get_nowait()
+            yield scan()
+    finally:
+        observer.stop()
+        observer.join()